@@ -1,9 +1,9 @@
 import os
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import contextily as ctx
-from geopy.distance import geodesic
+from ais_loader import load_ais_csv, save_ais_csv
+from trajectory_catalog import get_catalog_bounds
+from geo_distance import cached_consecutive_distances, consecutive_distances, pairwise_distances
+from basemap_cache import load_basemap, draw_basemap
 
 # User-defined parameters for missing gaps
 
@@ -31,6 +31,17 @@ gap_start_locations_realistic_small = [
     0.41, 0.42, 0.43, 0.44, 0.45, 0.46, 0.47, 0.48, 0.49, 0.5
 ]  # Start positions of small gaps as percentages
 
+# Accuracy tier of the distances between consecutive points: "geodesic" (exact, as geopy), or the faster
+# "vincenty" or "haversine"
+distance_method = "geodesic"
+
+# Basemap cache (None for ~/.cache/ais_basemaps); in offline mode only cached backgrounds are used
+basemap_cache_dir = None
+offline_basemap = False
+
+# Directory to keep the catalogs of the output folders in (None keeps them next to the files)
+catalog_dir = None
+
 # Define the input and output folders
 input_folder = r"C:/Users/HU84VR/Downloads/AIS Project1/Test Trajectories for AIS 20240831//25 chosen perfect trajectory data"
 output_single_folder = r"C:/Users/HU84VR/Downloads/AIS Project1/Test Trajectories for AIS 20240831/data_single"
@@ -43,35 +54,29 @@ single_plot_folder_path = os.path.join(output_plot_folder, "plots_single")
 multiple_plot_folder_path = os.path.join(output_plot_folder, "plots_multiple")
 realistic_frequency_plot_folder_path = os.path.join(output_plot_folder, "plots_realistic_frequency")
 
-# Create output directories if they don't exist
-os.makedirs(output_single_folder, exist_ok=True)
-os.makedirs(output_multiple_folder, exist_ok=True)
-os.makedirs(output_realistic_folder, exist_ok=True)
-os.makedirs(single_plot_folder_path, exist_ok=True)
-os.makedirs(multiple_plot_folder_path, exist_ok=True)
-os.makedirs(realistic_frequency_plot_folder_path, exist_ok=True)
-
 
-# Function to calculate the distance between two points using the geodesic formula
-def calculate_distance(lat1, lon1, lat2, lon2):
-    return geodesic((lat1, lon1), (lat2, lon2)).kilometers
+# Function to find the number of points to remove based on a given gap size in kilometers, from the distances
+# (meters) between consecutive points of the trajectory
+def calculate_points_to_remove(df, gap_size_km, distances_m=None):
+    if distances_m is None:
+        distances_m = consecutive_distances(df['Latitude'], df['Longitude'], distance_method)
 
+    # First point at which the distance travelled from the start reaches the gap size
+    reached = np.flatnonzero(np.cumsum(distances_m[1:]) / 1000 >= gap_size_km)
+    return int(reached[0]) + 1 if len(reached) else 0
 
-# Function to find the number of points to remove based on a given gap size in kilometers
-def calculate_points_to_remove(df, gap_size_km):
-    total_distance = 0
-    points_to_remove = 0
 
-    for i in range(1, len(df)):
-        total_distance += calculate_distance(
-            df.iloc[i - 1]['Latitude'], df.iloc[i - 1]['Longitude'],
-            df.iloc[i]['Latitude'], df.iloc[i]['Longitude']
-        )
-        if total_distance >= gap_size_km:
-            points_to_remove = i
-            break
-
-    return points_to_remove
+# Function to update the consecutive distances after the rows start_idx:end_idx were dropped from df (already
+# reset to the new index). Only the distance across the new gap has to be computed.
+def remove_distances(df, distances_m, start_idx, end_idx):
+    distances_m = np.concatenate([distances_m[:start_idx], distances_m[end_idx:]])
+    if start_idx == 0 and len(distances_m) > 0:
+        distances_m[0] = np.nan
+    elif 0 < start_idx < len(distances_m):
+        distances_m[start_idx] = pairwise_distances(
+            df['Latitude'].iloc[start_idx - 1], df['Longitude'].iloc[start_idx - 1],
+            df['Latitude'].iloc[start_idx], df['Longitude'].iloc[start_idx], distance_method)
+    return distances_m
 
 
 # Function to convert a percentage into a starting index for a DataFrame
@@ -88,7 +93,7 @@ def check_overlap(existing_ranges, new_range):
 
 
 # Function to apply missing data scenarios based on user-defined parameters
-def apply_reduction_methods(df, file_name):
+def apply_reduction_methods(df, file_name, distances_m=None):
     length = len(df)
 
     # Extract the MMSI number from the DataFrame (assuming the MMSI column exists)
@@ -102,7 +107,9 @@ def apply_reduction_methods(df, file_name):
     applied_ranges = []
 
     # Single large gap reduction
-    points_to_remove_single = calculate_points_to_remove(df, gap_size_km_single)
+    if distances_m is None:
+        distances_m = consecutive_distances(df['Latitude'], df['Longitude'], distance_method)
+    points_to_remove_single = calculate_points_to_remove(df, gap_size_km_single, distances_m)
     start_idx_large = get_start_index_from_percentage(df, gap_start_single)
     end_idx_large = min(start_idx_large + points_to_remove_single, len(df))  # Ensure end_idx is within bounds
 
@@ -116,8 +123,10 @@ def apply_reduction_methods(df, file_name):
     # Multiple gap reduction
     df_multiple_gap = df.copy()
     applied_ranges_multiple = []
+    distances_multiple = distances_m
     for gap_start_percentage in gap_start_locations_multiple:
-        points_to_remove_multiple = calculate_points_to_remove(df_multiple_gap, gap_size_km_multiple)
+        points_to_remove_multiple = calculate_points_to_remove(df_multiple_gap, gap_size_km_multiple,
+                                                               distances_multiple)
         start_idx = get_start_index_from_percentage(df_multiple_gap, gap_start_percentage)
         end_idx = min(start_idx + points_to_remove_multiple, len(df_multiple_gap))  # Ensure end_idx is within bounds
 
@@ -128,15 +137,17 @@ def apply_reduction_methods(df, file_name):
             )
             df_multiple_gap.reset_index(drop=True, inplace=True)
             applied_ranges_multiple.append((start_idx, end_idx))
+            distances_multiple = remove_distances(df_multiple_gap, distances_multiple, start_idx, end_idx)
 
     # Realistic frequency reduction
     df_realistic_frequency = df.copy()
     applied_ranges_realistic = []
+    distances_realistic = distances_m
 
     # Large gaps for realistic frequency pattern
     for gap_start_percentage in gap_start_locations_realistic_large:
         points_to_remove_realistic_large = calculate_points_to_remove(
-            df_realistic_frequency, gap_size_km_realistic_large
+            df_realistic_frequency, gap_size_km_realistic_large, distances_realistic
         )
         start_idx_large_realistic = get_start_index_from_percentage(
             df_realistic_frequency, gap_start_percentage
@@ -153,11 +164,13 @@ def apply_reduction_methods(df, file_name):
             )
             df_realistic_frequency.reset_index(drop=True, inplace=True)
             applied_ranges_realistic.append((start_idx_large_realistic, end_idx_large_realistic))
+            distances_realistic = remove_distances(df_realistic_frequency, distances_realistic,
+                                                   start_idx_large_realistic, end_idx_large_realistic)
 
     # Small gaps for realistic frequency pattern
     for gap_start_percentage in gap_start_locations_realistic_small:
         points_to_remove_realistic_small = calculate_points_to_remove(
-            df_realistic_frequency, gap_size_km_realistic_small
+            df_realistic_frequency, gap_size_km_realistic_small, distances_realistic
         )
         start_idx_small_realistic = get_start_index_from_percentage(
             df_realistic_frequency, gap_start_percentage
@@ -174,6 +187,8 @@ def apply_reduction_methods(df, file_name):
             )
             df_realistic_frequency.reset_index(drop=True, inplace=True)
             applied_ranges_realistic.append((start_idx_small_realistic, end_idx_small_realistic))
+            distances_realistic = remove_distances(df_realistic_frequency, distances_realistic,
+                                                   start_idx_small_realistic, end_idx_small_realistic)
 
     # Define the new filenames based on the MMSI number and the scenario type
     single_gap_file_name = f"AIS data of MMSI {mmsi_number} Class A_single gap.csv"
@@ -181,26 +196,14 @@ def apply_reduction_methods(df, file_name):
     realistic_frequency_file_name = f"AIS data of MMSI {mmsi_number} Class A_realistic_frequency.csv"
 
     # Save the files to the corresponding folders
-    df_single_gap.to_csv(os.path.join(output_single_folder, single_gap_file_name), index=False)
-    df_multiple_gap.to_csv(os.path.join(output_multiple_folder, multiple_gaps_file_name), index=False)
-    df_realistic_frequency.to_csv(os.path.join(output_realistic_folder, realistic_frequency_file_name), index=False)
+    save_ais_csv(df_single_gap, os.path.join(output_single_folder, single_gap_file_name))
+    save_ais_csv(df_multiple_gap, os.path.join(output_multiple_folder, multiple_gaps_file_name))
+    save_ais_csv(df_realistic_frequency, os.path.join(output_realistic_folder, realistic_frequency_file_name))
 
 
 # Function to calculate the bounding box (extent) for the plots
 def get_bounding_box(folder_path):
-    min_lat, max_lat = float('inf'), -float('inf')
-    min_lon, max_lon = float('inf'), -float('inf')
-
-    # Loop through all CSV files and calculate the bounding box
-    for filename in os.listdir(folder_path):
-        if filename.endswith('.csv'):
-            file_path = os.path.join(folder_path, filename)
-            data = pd.read_csv(file_path)
-            if 'Latitude' in data.columns and 'Longitude' in data.columns:
-                min_lat = min(min_lat, data['Latitude'].min())
-                max_lat = max(max_lat, data['Latitude'].max())
-                min_lon = min(min_lon, data['Longitude'].min())
-                max_lon = max(max_lon, data['Longitude'].max())
+    min_lat, max_lat, min_lon, max_lon = get_catalog_bounds(folder_path, catalog_dir)
 
     return [min_lon, max_lon, min_lat, max_lat]
 
@@ -217,8 +220,10 @@ def extract_mmsi_from_filename(filename):
 
 
 # Function to plot and save trajectory with start (green), end (red) points, and smaller blue points for the rest
-def plot_and_save_trajectory_with_map(csv_path, save_path, title, bbox, pattern_type):
-    data = pd.read_csv(csv_path)
+def plot_and_save_trajectory_with_map(csv_path, save_path, title, bbox, pattern_type, basemap=None):
+    import matplotlib.pyplot as plt
+
+    data = load_ais_csv(csv_path, columns=['Latitude', 'Longitude'])
     mmsi_number = extract_mmsi_from_filename(title)
 
     # Ensure the columns for latitude and longitude exist
@@ -250,8 +255,8 @@ def plot_and_save_trajectory_with_map(csv_path, save_path, title, bbox, pattern_
         ax.set_xlim(bbox[0], bbox[1])
         ax.set_ylim(bbox[2], bbox[3])
 
-        # Add OpenStreetMap tiles using contextily
-        ctx.add_basemap(ax, crs='EPSG:4326', source=ctx.providers.OpenStreetMap.Mapnik)
+        # Add the OpenStreetMap background of the bounding box, fetched once per folder
+        draw_basemap(ax, basemap)
 
         # Define the filename based on the pattern type
         if pattern_type == "single":
@@ -273,37 +278,54 @@ def plot_and_save_trajectory_with_map(csv_path, save_path, title, bbox, pattern_
 def plot_and_save_all_trajectories_from_folder_with_map(folder_path, save_folder_path, bbox, pattern_type):
     if not os.path.exists(save_folder_path):
         os.makedirs(save_folder_path)  # Create the directory if it doesn't exist
+
+    basemap = load_basemap(bbox, basemap_cache_dir, offline_basemap)
     for filename in os.listdir(folder_path):
         if filename.endswith('.csv'):
             file_path = os.path.join(folder_path, filename)
-            plot_and_save_trajectory_with_map(file_path, save_folder_path, filename, bbox, pattern_type)
+            plot_and_save_trajectory_with_map(file_path, save_folder_path, filename, bbox, pattern_type, basemap)
+
+
+# Function to reduce every trajectory of the input folder to the three missing patterns and plot the results
+def main():
+    # Create output directories if they don't exist
+    os.makedirs(output_single_folder, exist_ok=True)
+    os.makedirs(output_multiple_folder, exist_ok=True)
+    os.makedirs(output_realistic_folder, exist_ok=True)
+    os.makedirs(single_plot_folder_path, exist_ok=True)
+    os.makedirs(multiple_plot_folder_path, exist_ok=True)
+    os.makedirs(realistic_frequency_plot_folder_path, exist_ok=True)
+
+    # Process each CSV file in the input folder
+    for file_name in os.listdir(input_folder):
+        if file_name.endswith('.csv'):
+            file_path = os.path.join(input_folder, file_name)
+            df = load_ais_csv(file_path, coordinate_dtype="float64")  # Coordinates are written back out
+            distances_m, _ = cached_consecutive_distances(file_path, df['Latitude'], df['Longitude'], distance_method)
+            apply_reduction_methods(df, file_name, distances_m)
 
+    print("AIS Data reduction complete.")
 
-# Process each CSV file in the input folder
-for file_name in os.listdir(input_folder):
-    if file_name.endswith('.csv'):
-        file_path = os.path.join(input_folder, file_name)
-        df = pd.read_csv(file_path)
-        apply_reduction_methods(df, file_name)
+    # Calculate the bounding box across all the data to ensure uniformity in the plotted region
+    bbox_single = get_bounding_box(output_single_folder)
+    bbox_multiple = get_bounding_box(output_multiple_folder)
+    bbox_realistic = get_bounding_box(output_realistic_folder)
 
-print("AIS Data reduction complete.")
+    # Plot and save all trajectories from the 'single' folder with a map background
+    plot_and_save_all_trajectories_from_folder_with_map(output_single_folder, single_plot_folder_path, bbox_single,
+                                                        "single")
 
-# Calculate the bounding box across all the data to ensure uniformity in the plotted region
-bbox_single = get_bounding_box(output_single_folder)
-bbox_multiple = get_bounding_box(output_multiple_folder)
-bbox_realistic = get_bounding_box(output_realistic_folder)
+    # Plot and save all trajectories from the 'multiple' folder with a map background
+    plot_and_save_all_trajectories_from_folder_with_map(output_multiple_folder, multiple_plot_folder_path,
+                                                        bbox_multiple, "multiple")
 
-# Plot and save all trajectories from the 'single' folder with a map background
-plot_and_save_all_trajectories_from_folder_with_map(output_single_folder, single_plot_folder_path, bbox_single,
-                                                    "single")
+    # Plot and save all trajectories from the 'realistic_frequency' folder with a map background
+    plot_and_save_all_trajectories_from_folder_with_map(
+        output_realistic_folder, realistic_frequency_plot_folder_path, bbox_realistic, "realistic"
+    )
 
-# Plot and save all trajectories from the 'multiple' folder with a map background
-plot_and_save_all_trajectories_from_folder_with_map(output_multiple_folder, multiple_plot_folder_path, bbox_multiple,
-                                                    "multiple")
+    print("AIS Data plotting and saving complete.")
 
-# Plot and save all trajectories from the 'realistic_frequency' folder with a map background
-plot_and_save_all_trajectories_from_folder_with_map(
-    output_realistic_folder, realistic_frequency_plot_folder_path, bbox_realistic, "realistic"
-)
 
-print("AIS Data plotting and saving complete.")
+if __name__ == "__main__":
+    main()
@@ -52,11 +52,129 @@ import pandas as pd
 import os
 import argparse
 import glob
+import time
+import shutil
+import json
+from collections import OrderedDict, Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from ais_loader import AIS_TIMESTAMP_FORMAT, load_ais_csv, save_ais_csv, compute_file_hash
+from trajectory_quality import compute_quality_partials, finalize_quality, save_quality, merge_quality_tables
 
 
-def process_ais_data(input_csv, output_directory):
-    # Load data
-    data = pd.read_csv(input_csv)
+# Function to split the data into one slice per MMSI using a single grouping pass
+def partition_by_mmsi(data):
+    # Group once instead of scanning the whole frame for every vessel; sort=False keeps
+    # the MMSIs in order of first appearance and the rows in their original order
+    for mmsi, mmsi_data in data.groupby('MMSI', sort=False):
+        ship_type = mmsi_data['Ship type'].iloc[0]  # Get the Ship type for the MMSI
+        yield mmsi, ship_type, mmsi_data
+
+
+# Function to build the output path of an MMSI file and create its ship type directory
+def get_mmsi_file_path(output_directory, base_filename, ship_type, mmsi):
+    # Define the ship type directory path within the base output directory
+    ship_type_dir = os.path.join(output_directory, base_filename, str(ship_type))
+    os.makedirs(ship_type_dir, exist_ok=True)  # Create directory if it doesn't exist
+
+    # Define the output file path with the desired format
+    return os.path.join(ship_type_dir, f"{base_filename}_MMSI_{mmsi}.csv")
+
+
+# Function to report the classification throughput so the runtime of a full day can be checked
+def report_throughput(input_csv, output_directory, num_rows, num_mmsi, start_time):
+    elapsed = time.perf_counter() - start_time
+    rows_per_sec = num_rows / elapsed if elapsed > 0 else float('inf')
+    print(f"Classified {num_rows} rows of {num_mmsi} MMSIs in {elapsed:.2f} s ({rows_per_sec:,.0f} rows/sec)")
+    print(f"Data for '{input_csv}' has been successfully processed and saved to: {output_directory}")
+
+
+# Columns of the aisdk schema stored as floats in the Parquet dataset; the rest is kept as text
+PARQUET_FLOAT_COLUMNS = ['Latitude', 'Longitude', 'ROT', 'SOG', 'COG', 'Heading', 'Width', 'Length',
+                         'Draught', 'A', 'B', 'C', 'D']
+
+
+# Function to give the columns a fixed type so every day and every chunk share one Parquet schema
+def to_parquet_frame(data):
+    frame = pd.DataFrame(index=data.index)
+    for column in data.columns:
+        if column == '# Timestamp':
+            frame[column] = pd.to_datetime(data[column], format=AIS_TIMESTAMP_FORMAT, errors='coerce')
+        elif column == 'MMSI':
+            frame[column] = pd.to_numeric(data[column], errors='coerce').astype('Int64')
+        elif column in PARQUET_FLOAT_COLUMNS:
+            frame[column] = pd.to_numeric(data[column], errors='coerce').astype('float64')
+        else:
+            frame[column] = data[column].astype('string')
+    return frame
+
+
+# Function to look up the ship type of every row from the first row of its MMSI, as in the CSV output
+def assign_ship_types(data, mmsi_ship_types):
+    first_rows = data.loc[~data['MMSI'].duplicated(), ['MMSI', 'Ship type']]
+    for mmsi, ship_type in zip(first_rows['MMSI'], first_rows['Ship type']):
+        mmsi_ship_types.setdefault(mmsi, str(ship_type))
+    return data['MMSI'].map(mmsi_ship_types)
+
+
+# Function to remove the partition of a day so a rerun replaces it instead of adding files to it
+def clear_parquet_day(output_directory, base_filename):
+    shutil.rmtree(os.path.join(output_directory, f"day={base_filename}"), ignore_errors=True)
+
+
+# Function to write the rows of a day into the Hive-partitioned dataset day=/ship_type=/MMSI=
+def write_parquet_partitions(data, output_directory, base_filename, mmsi_ship_types, part_name="part"):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    frame = to_parquet_frame(data)
+    frame = frame.loc[frame['MMSI'].notna()]
+    frame['day'] = base_filename
+    frame['ship_type'] = assign_ship_types(frame, mmsi_ship_types)
+
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    pq.write_to_dataset(
+        table,
+        root_path=output_directory,
+        partition_cols=['day', 'ship_type', 'MMSI'],
+        basename_template=f"{part_name}-{{i}}.parquet",
+        existing_data_behavior='overwrite_or_ignore',
+        max_partitions=max(1024, frame['MMSI'].nunique() + 1),
+    )
+
+    return frame['ship_type'].value_counts().to_dict()
+
+
+# Function to load vessels from the Parquet dataset, pushing the day/ship type/MMSI filters down to the partitions
+def load_parquet_trajectories(dataset_directory, mmsi=None, ship_type=None, day=None, columns=None):
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    # Read the partition keys with fixed types instead of letting them be inferred from the paths
+    partitioning = ds.partitioning(
+        pa.schema([('day', pa.string()), ('ship_type', pa.string()), ('MMSI', pa.int64())]), flavor='hive'
+    )
+    dataset = ds.dataset(dataset_directory, format='parquet', partitioning=partitioning)
+
+    conditions = []
+    if day is not None:
+        conditions.append(ds.field('day') == day)
+    if ship_type is not None:
+        conditions.append(ds.field('ship_type') == str(ship_type))
+    if mmsi is not None:
+        conditions.append(ds.field('MMSI') == int(mmsi))
+
+    row_filter = None
+    for condition in conditions:
+        row_filter = condition if row_filter is None else row_filter & condition
+    return dataset.to_table(columns=columns, filter=row_filter).to_pandas()
+
+
+def process_ais_data(input_csv, output_directory, output_format="csv"):
+    start_time = time.perf_counter()
+
+    # Load data; the coordinates stay float64 since they are written back out, and the timestamps are only
+    # parsed for the typed Parquet output since the CSV output passes them through unchanged
+    data = load_ais_csv(input_csv, coordinate_dtype="float64", parse_timestamps=output_format == "parquet")
 
     # Check for necessary columns
     if 'MMSI' not in data.columns or 'Ship type' not in data.columns:
@@ -65,46 +183,347 @@ def process_ais_data(input_csv, output_directory):
     # Extract base filename (without extension) to use in the output structure
     base_filename = os.path.splitext(os.path.basename(input_csv))[0]
 
-    # Get unique MMSI values
-    unique_mmsi = data['MMSI'].unique()
+    # Clear the day partition before anything is written into it, the quality table included
+    if output_format == "parquet":
+        clear_parquet_day(output_directory, base_filename)
 
-    # Iterate through each MMSI and save to separate CSV files
-    for mmsi in unique_mmsi:
-        mmsi_data = data[data['MMSI'] == mmsi]
-        ship_type = mmsi_data['Ship type'].iloc[0]  # Get the Ship type for the MMSI
+    # Compute the per-MMSI quality statistics in the same pass
+    quality_partials, _ = compute_quality_partials(data)
+    save_quality(finalize_quality([quality_partials], base_filename),
+                 os.path.join(output_directory, get_day_directory_name(base_filename, output_format)))
 
-        # Define the ship type directory path within the base output directory
-        ship_type_dir = os.path.join(output_directory, base_filename, str(ship_type))
-        os.makedirs(ship_type_dir, exist_ok=True)  # Create directory if it doesn't exist
+    # Write the whole day into the partitioned Parquet dataset
+    if output_format == "parquet":
+        mmsi_ship_types = {}
+        ship_type_rows = write_parquet_partitions(data, output_directory, base_filename, mmsi_ship_types)
+        report_throughput(input_csv, output_directory, len(data), len(mmsi_ship_types), start_time)
+        return {"rows": len(data), "mmsi": len(mmsi_ship_types), "ship_type_rows": ship_type_rows}
 
-        # Define the output file path with the desired format
-        mmsi_file_path = os.path.join(
-            ship_type_dir,
-            f"{base_filename}_MMSI_{mmsi}.csv"
-        )
+    # Save each MMSI slice to a separate CSV file
+    num_mmsi = 0
+    ship_type_rows = Counter()
+    for mmsi, ship_type, mmsi_data in partition_by_mmsi(data):
+        mmsi_file_path = get_mmsi_file_path(output_directory, base_filename, ship_type, mmsi)
 
         # Save the MMSI data to the CSV file
-        mmsi_data.to_csv(mmsi_file_path, index=False)
-        print(f"Data has been successfully processed and saved to: {ship_type_dir}")
+        save_ais_csv(mmsi_data, mmsi_file_path)
+        num_mmsi += 1
+        ship_type_rows[str(ship_type)] += len(mmsi_data)
+        print(f"Data has been successfully processed and saved to: {os.path.dirname(mmsi_file_path)}")
 
-    print(f"Data for '{input_csv}' has been successfully processed and saved to: {output_directory}")
+    report_throughput(input_csv, output_directory, len(data), num_mmsi, start_time)
+
+    return {"rows": len(data), "mmsi": num_mmsi, "ship_type_rows": dict(ship_type_rows)}
+
+
+# Pool of open output files that closes the least recently used handle once the limit is reached
+class LRUFilePool:
+    def __init__(self, max_open_files):
+        self.max_open_files = max(1, max_open_files)
+        self.handles = OrderedDict()
+        self.created = set()
+
+    def get(self, path):
+        # Reuse an open handle and mark it as the most recently used one
+        if path in self.handles:
+            self.handles.move_to_end(path)
+            return self.handles[path], False
 
+        # Close the least recently used handle to stay under the file descriptor limit
+        if len(self.handles) >= self.max_open_files:
+            _, oldest = self.handles.popitem(last=False)
+            oldest.close()
+
+        # Truncate a file the first time it is seen in this run, append to it afterwards
+        is_new = path not in self.created
+        handle = open(path, "w" if is_new else "a", newline="", encoding="utf-8")
+        self.created.add(path)
+        self.handles[path] = handle
+        return handle, is_new
+
+    def close_all(self):
+        for handle in self.handles.values():
+            handle.close()
+        self.handles.clear()
+
+
+# Function to derive the chunk size (rows) that keeps a chunk and its grouped copies under the memory cap
+def estimate_chunk_size(input_csv, max_memory_mb, sample_rows=10000):
+    sample = pd.read_csv(input_csv, nrows=sample_rows, dtype=str, keep_default_na=False)
+    if sample.empty:
+        return sample_rows
+    bytes_per_row = sample.memory_usage(deep=True).sum() / len(sample)
+
+    # The chunk, its per-MMSI slices and the CSV text buffers all live at the same time
+    return max(1000, int(max_memory_mb * 1024 * 1024 / (3 * bytes_per_row)))
+
+
+def process_ais_data_streaming(input_csv, output_directory, max_memory_mb=512, max_open_files=256,
+                               output_format="csv"):
+    start_time = time.perf_counter()
+
+    # Check for necessary columns without loading the file
+    columns = pd.read_csv(input_csv, nrows=0).columns
+    if 'MMSI' not in columns or 'Ship type' not in columns:
+        raise ValueError("The input CSV must contain 'MMSI' and 'Ship type' columns.")
+
+    # Extract base filename (without extension) to use in the output structure
+    base_filename = os.path.splitext(os.path.basename(input_csv))[0]
+
+    chunk_size = estimate_chunk_size(input_csv, max_memory_mb)
+    print(f"Streaming '{input_csv}' in chunks of {chunk_size} rows (memory cap: {max_memory_mb} MB)")
+
+    # The quality statistics are collected per chunk and combined once the file is done
+    quality_partials = []
+    last_points = None
+    day_directory = os.path.join(output_directory, get_day_directory_name(base_filename, output_format))
+
+    # Append every chunk to the day partition as its own set of Parquet files
+    if output_format == "parquet":
+        mmsi_ship_types = {}
+        ship_type_rows = Counter()
+        num_rows = 0
+        clear_parquet_day(output_directory, base_filename)
+        chunks = pd.read_csv(input_csv, chunksize=chunk_size, dtype=str)
+        for chunk_number, chunk in enumerate(chunks):
+            ship_type_rows.update(write_parquet_partitions(chunk, output_directory, base_filename, mmsi_ship_types,
+                                                           part_name=f"chunk{chunk_number:05d}"))
+            partials, last_points = compute_quality_partials(chunk, last_points)
+            quality_partials.append(partials)
+            num_rows += len(chunk)
+        if quality_partials:
+            save_quality(finalize_quality(quality_partials, base_filename), day_directory)
+        report_throughput(input_csv, output_directory, num_rows, len(mmsi_ship_types), start_time)
+        return {"rows": num_rows, "mmsi": len(mmsi_ship_types), "ship_type_rows": dict(ship_type_rows)}
+
+    # The output path of each MMSI is fixed by the ship type of its first row in the file
+    mmsi_file_paths = {}
+    ship_type_rows = Counter()
+    pool = LRUFilePool(max_open_files)
+    num_rows = 0
+    try:
+        # Read the values as text so they are written back unchanged, whatever the chunk contains
+        for chunk in pd.read_csv(input_csv, chunksize=chunk_size, dtype=str, keep_default_na=False):
+            # Rows without an MMSI are left out, as the grouping of the non-streaming mode does
+            chunk_with_mmsi = chunk.loc[chunk['MMSI'] != ""]
+            for mmsi, ship_type, mmsi_data in partition_by_mmsi(chunk_with_mmsi):
+                if mmsi not in mmsi_file_paths:
+                    mmsi_file_paths[mmsi] = get_mmsi_file_path(output_directory, base_filename, ship_type, mmsi)
+
+                # Append the rows of this chunk, writing the header only when the file is created
+                handle, is_new = pool.get(mmsi_file_paths[mmsi])
+                mmsi_data.to_csv(handle, index=False, header=is_new)
+                ship_type_rows[os.path.basename(os.path.dirname(mmsi_file_paths[mmsi]))] += len(mmsi_data)
+                if is_new:
+                    print(f"Data has been successfully processed and saved to: {os.path.dirname(mmsi_file_paths[mmsi])}")
+            partials, last_points = compute_quality_partials(chunk_with_mmsi, last_points)
+            quality_partials.append(partials)
+            num_rows += len(chunk)
+    finally:
+        pool.close_all()
+
+    if quality_partials:
+        save_quality(finalize_quality(quality_partials, base_filename), day_directory)
+
+    report_throughput(input_csv, output_directory, num_rows, len(mmsi_file_paths), start_time)
+
+    return {"rows": num_rows, "mmsi": len(mmsi_file_paths), "ship_type_rows": dict(ship_type_rows)}
+
+
+# The leading underscore keeps Parquet dataset readers from treating the manifest as a data file
+MANIFEST_FILENAME = "_classification_manifest.json"
+
+
+# Function to name the directory that holds all outputs of one daily file
+def get_day_directory_name(base_filename, output_format):
+    return f"day={base_filename}" if output_format == "parquet" else base_filename
+
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+# Function to save the manifest through a temporary file so a crash never leaves it half-written
+def save_manifest(manifest, manifest_path):
+    temp_path = f"{manifest_path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_path, manifest_path)
+
+
+# Function to build the manifest entry of a classified input file
+def build_manifest_entry(csv_file, output_format, stats):
+    file_stat = os.stat(csv_file)
+    return {
+        "path": os.path.abspath(csv_file),
+        "size": file_stat.st_size,
+        "mtime": file_stat.st_mtime,
+        "sha256": compute_file_hash(csv_file),
+        "output_format": output_format,
+        "rows": stats["rows"],
+        "mmsi": stats["mmsi"],
+        "ship_type_rows": stats["ship_type_rows"],
+    }
+
+
+# Function to check whether an input file was already classified and has not changed since
+def is_up_to_date(entry, csv_file, output_directory, output_format):
+    if entry is None or entry["output_format"] != output_format:
+        return False
+
+    base_filename = os.path.splitext(os.path.basename(csv_file))[0]
+    if not os.path.isdir(os.path.join(output_directory, get_day_directory_name(base_filename, output_format))):
+        return False
+
+    file_stat = os.stat(csv_file)
+    if file_stat.st_size != entry["size"]:
+        return False
+    if file_stat.st_mtime == entry["mtime"]:
+        return True
+
+    # The file was touched; only hash it when size and mtime alone cannot tell
+    if compute_file_hash(csv_file) == entry["sha256"]:
+        entry["mtime"] = file_stat.st_mtime
+        return True
+    return False
+
+
+# Function to move the staged outputs of a day into place, replacing the outputs of an earlier run
+def publish_day_output(staging_directory, output_directory, day_directory_name):
+    staged_path = os.path.join(staging_directory, day_directory_name)
+    final_path = os.path.join(output_directory, day_directory_name)
+    os.makedirs(staged_path, exist_ok=True)  # An input without rows still gets its (empty) day directory
+
+    old_path = None
+    if os.path.exists(final_path):
+        old_path = os.path.join(output_directory, f".old-{day_directory_name}-{os.getpid()}")
+        os.replace(final_path, old_path)
+    os.replace(staged_path, final_path)
+
+    if old_path is not None:
+        shutil.rmtree(old_path)
+    shutil.rmtree(staging_directory, ignore_errors=True)
+
+
+# Function to remove staging directories left behind by a run that crashed
+def remove_stale_staging_directories(output_directory):
+    for name in os.listdir(output_directory):
+        if name.startswith(".staging-") or name.startswith(".old-"):
+            shutil.rmtree(os.path.join(output_directory, name), ignore_errors=True)
+
+
+# Function to classify one CSV file with the selected mode
+def classify_file(csv_file, output_directory, stream=False, max_memory_mb=512, max_open_files=256,
+                  output_format="csv"):
+    # Write into a staging directory next to the outputs and only rename it into place once the file is done,
+    # so a crash never leaves half-written MMSI files or partitions behind
+    base_filename = os.path.splitext(os.path.basename(csv_file))[0]
+    staging_directory = os.path.join(output_directory, f".staging-{base_filename}-{os.getpid()}")
+    shutil.rmtree(staging_directory, ignore_errors=True)
+
+    if stream:
+        stats = process_ais_data_streaming(csv_file, staging_directory, max_memory_mb, max_open_files, output_format)
+    else:
+        stats = process_ais_data(csv_file, staging_directory, output_format)
+
+    publish_day_output(staging_directory, output_directory, get_day_directory_name(base_filename, output_format))
+    print(f"Published the outputs of '{csv_file}' to: {output_directory}")
+    return stats
+
+
+def process_all_files_in_directory(input_directory, output_directory, stream=False, max_memory_mb=512,
+                                   max_open_files=256, workers=1, output_format="csv", force=False):
+    start_time = time.perf_counter()
+    os.makedirs(output_directory, exist_ok=True)
+    remove_stale_staging_directories(output_directory)
+
+    # Skip the files that the manifest records as classified and unchanged; CSV and Parquet outputs of the
+    # same directory are tracked separately
+    manifest_path = os.path.join(output_directory, MANIFEST_FILENAME)
+    manifest = load_manifest(manifest_path)
+    format_entries = manifest.setdefault(output_format, {})
+    csv_files = []
+    for csv_file in glob.glob(os.path.join(input_directory, "*.csv")):
+        if not force and is_up_to_date(format_entries.get(os.path.abspath(csv_file)), csv_file, output_directory,
+                                       output_format):
+            print(f"Skipping '{csv_file}': unchanged since it was classified")
+            continue
+        csv_files.append(csv_file)
+
+    # Record every finished file right away so a rerun after a crash resumes from there; a file that fails is
+    # reported and the others carry on, with one worker or many. Returns the number of rows classified.
+    failed_files = []
+
+    def record(csv_file, get_stats):
+        try:
+            stats = get_stats()
+        except Exception as e:
+            failed_files.append(csv_file)
+            print(f"Error processing file {csv_file}: {e}")
+            return 0
+        format_entries[os.path.abspath(csv_file)] = build_manifest_entry(csv_file, output_format, stats)
+        save_manifest(manifest, manifest_path)
+        return stats["rows"]
 
-def process_all_files_in_directory(input_directory, output_directory):
     # Loop through all CSV files in the input directory
-    csv_files = glob.glob(os.path.join(input_directory, "*.csv"))
-    for csv_file in csv_files:
-        process_ais_data(csv_file, output_directory)
+    total_rows = 0
+    if workers <= 1:
+        for csv_file in csv_files:
+            total_rows += record(csv_file, lambda: classify_file(csv_file, output_directory, stream, max_memory_mb,
+                                                                 max_open_files, output_format))
+    else:
+        # Each file writes only below its own base_filename directory, so the workers never share an output file
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(classify_file, csv_file, output_directory, stream, max_memory_mb, max_open_files,
+                                output_format): csv_file
+                for csv_file in csv_files
+            }
+            for future in as_completed(futures):
+                total_rows += record(futures[future], future.result)
+    save_manifest(manifest, manifest_path)
+    merge_quality_tables(output_directory)
 
+    # Merge the per-file results into one summary for the whole run
+    elapsed = time.perf_counter() - start_time
+    rows_per_sec = total_rows / elapsed if elapsed > 0 else float('inf')
+    print(f"Classified {total_rows} rows from {len(csv_files) - len(failed_files)} of {len(csv_files)} files "
+          f"with {max(1, workers)} worker(s) in {elapsed:.2f} s ({rows_per_sec:,.0f} rows/sec)")
+    if failed_files:
+        print(f"Failed files: {', '.join(failed_files)}")
 
-if __name__ == "__main__":
+
+def main(argv=None):
     # Set up argument parsing
     parser = argparse.ArgumentParser(description="Process multiple AIS CSV files by MMSI and ship type.")
     parser.add_argument("input_directory", type=str, help="Path to the input directory containing CSV files.")
     parser.add_argument("output_directory", type=str, help="Path to the output directory for classified CSV files.")
+    parser.add_argument("--stream", action="store_true",
+                        help="Read each CSV in chunks and append them to the MMSI files instead of loading it at once.")
+    parser.add_argument("--max_memory_mb", type=float, default=512,
+                        help="Approximate memory cap in MB used to size the chunks in streaming mode (default: 512).")
+    parser.add_argument("--max_open_files", type=int, default=256,
+                        help="Maximum number of MMSI files kept open at once in streaming mode (default: 256).")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes classifying files in parallel (default: 1). "
+                             "The memory cap and open file limit apply to each worker.")
+    parser.add_argument("--output_format", type=str, choices=["csv", "parquet"], default="csv",
+                        help="Write one CSV per MMSI (default) or a Hive-partitioned Parquet dataset "
+                             "(day=/ship_type=/MMSI=) below the output directory.")
+    parser.add_argument("--force", action="store_true",
+                        help="Reclassify every file, even those the manifest records as unchanged and done.")
 
     # Parse the arguments
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # Run the main function to process all files in the directory
-    process_all_files_in_directory(args.input_directory, args.output_directory)
+    process_all_files_in_directory(args.input_directory, args.output_directory, args.stream,
+                                   args.max_memory_mb, args.max_open_files, args.workers,
+                                   args.output_format, args.force)
+
+
+if __name__ == "__main__":
+    main()
@@ -225,70 +225,167 @@
 #     main()
 
 import pandas as pd
-from shapely.geometry import LineString, Point, mapping
 import json
+import textwrap
 import argparse
 import os
+import time
+import sqlite3
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from ais_loader import load_ais_csv, compute_file_hash
 
 
-def trajectory_to_geojson(data, mmsi_column='MMSI', timestamp_column='# Timestamp',
-                          lat_column='Latitude', lon_column='Longitude',
-                          draught_column='Draught', cog_column='COG',
-                          nav_status_column='Navigational status'):
+# Columns of the aisdk CSV files read by process_directory
+GEOJSON_COLUMNS = ['# Timestamp', 'MMSI', 'Latitude', 'Longitude', 'Draught', 'COG', 'Navigational status']
+LINE_COLUMNS = ['# Timestamp', 'MMSI', 'Latitude', 'Longitude']
+
+
+# Function to convert a trajectory into GeoJSON features, yielded one at a time: the LineString of the whole
+# trajectory first, then one Point per record. Returns None when there are too few points for a LineString.
+def trajectory_to_features(data, mmsi_column='MMSI', timestamp_column='# Timestamp',
+                           lat_column='Latitude', lon_column='Longitude',
+                           draught_column='Draught', cog_column='COG',
+                           nav_status_column='Navigational status'):
     # Filter out rows with missing latitude or longitude only
     data_filtered = data.dropna(subset=[lat_column, lon_column])
 
-    # Convert columns to string or float types where needed for JSON serialization
-    data_filtered[mmsi_column] = data_filtered[mmsi_column].astype(str)
-    data_filtered[timestamp_column] = data_filtered[timestamp_column].astype(str)
-    data_filtered[draught_column] = data_filtered[draught_column].astype(float)
-    data_filtered[cog_column] = data_filtered[cog_column].astype(float)
-    data_filtered[nav_status_column] = data_filtered[nav_status_column].astype(str)
-
-    # Create Points for each trajectory record with attributes
-    points = []
-    for _, row in data_filtered.iterrows():
-        if pd.notna(row[lat_column]) and pd.notna(row[lon_column]):  # Check for valid coordinates
-            point = Point(row[lon_column], row[lat_column])
-            # Store attributes with each point
-            point_attr = {
+    # Ensure there are at least two points for creating a LineString
+    if len(data_filtered) < 2:
+        print("Not enough valid data points to form a LineString.")
+        return None
+
+    # Convert whole columns to string or float types for JSON serialization; tolist() yields plain Python values
+    mmsis = data_filtered[mmsi_column].astype(str).tolist()
+    timestamps = data_filtered[timestamp_column].astype(str).tolist()
+    draughts = data_filtered[draught_column].astype(float).tolist()
+    cogs = data_filtered[cog_column].astype(float).tolist()
+    nav_statuses = data_filtered[nav_status_column].astype(str).tolist()
+
+    # Build the coordinate pairs of the LineString and its Points in bulk
+    coordinates = tuple(zip(data_filtered[lon_column].astype(float).tolist(),
+                            data_filtered[lat_column].astype(float).tolist()))
+
+    def generate_features():
+        yield {
+            "type": "Feature",
+            "geometry": {"type": "LineString", "coordinates": coordinates},
+            "properties": {"MMSI": mmsis[0]}  # Assume MMSI is consistent
+        }
+
+        # Create a Point feature for each trajectory record with attributes
+        for coordinate, mmsi, timestamp, draught, cog, nav_status in zip(coordinates, mmsis, timestamps, draughts,
+                                                                         cogs, nav_statuses):
+            yield {
                 "type": "Feature",
-                "geometry": mapping(point),
+                "geometry": {"type": "Point", "coordinates": coordinate},
                 "properties": {
-                    "MMSI": row[mmsi_column],
-                    "timestamp": row[timestamp_column],
-                    "draught": row[draught_column],
-                    "cog": row[cog_column],
-                    "navigation_status": row[nav_status_column]
+                    "MMSI": mmsi,
+                    "timestamp": timestamp,
+                    "draught": draught,
+                    "cog": cog,
+                    "navigation_status": nav_status
                 }
             }
-            points.append(point_attr)
 
-    # Ensure there are at least two points for creating a LineString
-    if len(points) < 2:
-        print("Not enough valid data points to form a LineString.")
-        return None
+    return generate_features()
+
 
-    # Create a LineString from Points
-    coordinates = [(p['geometry']['coordinates'][0], p['geometry']['coordinates'][1]) for p in points]
-    line = LineString(coordinates)
+def trajectory_to_geojson(data, **columns):
+    features = trajectory_to_features(data, **columns)
+    if features is None:
+        return None
 
     # Convert to GeoJSON format
-    geojson = {
-        "type": "FeatureCollection",
-        "features": [
-            {
-                "type": "Feature",
-                "geometry": mapping(line),
-                "properties": {"MMSI": data_filtered[mmsi_column].iloc[0]}  # Assume MMSI is consistent
-            },
-            *points  # Add individual points with attributes
-        ]
-    }
-    return geojson
-
-def process_directory(input_dir, output_dir):
-    # Traverse the input directory and process each CSV file
+    return {"type": "FeatureCollection", "features": list(features)}
+
+
+# File extension of each output format; GeoJSONSeq (RFC 8142) files are newline-delimited
+GEOJSON_EXTENSIONS = {"pretty": ".geojson", "minified": ".geojson", "seq": ".geojsons"}
+
+
+# Function to write features one at a time, so the whole FeatureCollection is never held as one document.
+# "pretty" writes the same bytes as json.dump(..., indent=2), "minified" drops all whitespace and "seq" writes
+# one record-separator-prefixed feature per line (GeoJSONSeq).
+def write_features(features, output_file, output_format="pretty"):
+    with open(output_file, "w") as f:
+        if output_format == "seq":
+            for feature in features:
+                f.write("\x1e" + json.dumps(feature, separators=(",", ":")) + "\n")
+        elif output_format == "minified":
+            f.write('{"type":"FeatureCollection","features":[')
+            for i, feature in enumerate(features):
+                f.write(("," if i else "") + json.dumps(feature, separators=(",", ":")))
+            f.write("]}")
+        else:
+            f.write('{\n  "type": "FeatureCollection",\n  "features": [')
+            for i, feature in enumerate(features):
+                f.write(",\n" if i else "\n")
+                f.write(textwrap.indent(json.dumps(feature, indent=2), "    "))
+            f.write("\n  ]\n}")
+
+
+# Manifest in the output directory recording the source hash of every converted CSV file
+GEOJSON_MANIFEST_FILENAME = "_geojson_manifest.json"
+
+
+# Function to convert one CSV file; the GeoJSON is written to a temporary file and renamed into place, so an
+# interrupted run never leaves a partial output that looks newer than its source
+def convert_file(input_file, output_file, output_format="pretty"):
+    # Load only the columns used in the GeoJSON; the timestamps are passed through as text
+    data = load_ais_csv(input_file, columns=GEOJSON_COLUMNS, coordinate_dtype="float64", parse_timestamps=False)
+
+    # Convert to GeoJSON features
+    features = trajectory_to_features(data)
+
+    # Check if conversion was successful (enough points to form a LineString)
+    if features is None:
+        print(f"Skipped {input_file} due to insufficient valid data points.")
+        return "insufficient", compute_file_hash(input_file)
+
+    # Stream the features into the GeoJSON file
+    temp_file = f"{output_file}.tmp"
+    write_features(features, temp_file, output_format)
+    os.replace(temp_file, output_file)
+    print(f"Processed {input_file} -> {output_file}")
+    return "converted", compute_file_hash(input_file)
+
+
+# Function to check whether the output of a CSV file is still up to date: either the output is newer than its
+# source, or the source content still has the hash recorded when it was converted
+def is_conversion_up_to_date(input_file, output_file, entry, output_format):
+    if entry is not None and entry["output_format"] != output_format:
+        return False
+
+    # Files without enough points have no output; they are up to date while their source is unchanged
+    if entry is not None and entry["status"] == "insufficient":
+        if entry["source_mtime"] == os.path.getmtime(input_file):
+            return True
+        return entry["sha256"] == compute_file_hash(input_file)
+
+    if not os.path.exists(output_file):
+        return False
+    if os.path.getmtime(output_file) >= os.path.getmtime(input_file):
+        return True
+    if entry is not None and entry["sha256"] == compute_file_hash(input_file):
+        os.utime(output_file, None)  # Refresh the mtime so the next run can decide without hashing
+        return True
+    return False
+
+
+def process_directory(input_dir, output_dir, output_format="pretty", workers=1, force=False):
+    start_time = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+
+    manifest_path = os.path.join(output_dir, GEOJSON_MANIFEST_FILENAME)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+
+    # Traverse the input directory and collect the CSV files whose outputs are missing or outdated
+    tasks = []
+    num_up_to_date = 0
     for root, _, files in os.walk(input_dir):
         for file in files:
             if file.endswith(".csv"):
@@ -300,36 +397,185 @@ def process_directory(input_dir, output_dir):
                 output_folder = os.path.join(output_dir, relative_path)
                 os.makedirs(output_folder, exist_ok=True)
 
-                # Set output file path with .geojson extension
-                output_file = os.path.join(output_folder, file.replace(".csv", ".geojson"))
+                # Set output file path with the extension of the output format
+                output_file = os.path.join(output_folder, file.replace(".csv", GEOJSON_EXTENSIONS[output_format]))
+
+                manifest_key = os.path.relpath(input_file, input_dir)
+                if not force and is_conversion_up_to_date(input_file, output_file, manifest.get(manifest_key),
+                                                          output_format):
+                    num_up_to_date += 1
+                    continue
+                tasks.append((manifest_key, input_file, output_file))
 
-                # Load the CSV file
-                data = pd.read_csv(input_file)
+    # Function to record the result of a conversion in the manifest
+    def record(manifest_key, input_file, status, sha256):
+        manifest[manifest_key] = {"sha256": sha256, "status": status, "output_format": output_format,
+                                  "source_mtime": os.path.getmtime(input_file)}
 
-                # Convert to GeoJSON
-                geojson_output = trajectory_to_geojson(data)
+    counts = Counter()
+    failed_files = []
+    try:
+        if workers <= 1:
+            for manifest_key, input_file, output_file in tasks:
+                try:
+                    status, sha256 = convert_file(input_file, output_file, output_format)
+                except Exception as e:
+                    failed_files.append(input_file)
+                    print(f"Error processing file {input_file}: {e}")
+                    continue
+                counts[status] += 1
+                record(manifest_key, input_file, status, sha256)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    executor.submit(convert_file, input_file, output_file, output_format): (manifest_key, input_file)
+                    for manifest_key, input_file, output_file in tasks
+                }
+                for future in as_completed(futures):
+                    manifest_key, input_file = futures[future]
+                    try:
+                        status, sha256 = future.result()
+                    except Exception as e:
+                        failed_files.append(input_file)
+                        print(f"Error processing file {input_file}: {e}")
+                        continue
+                    counts[status] += 1
+                    record(manifest_key, input_file, status, sha256)
+    finally:
+        # Save the manifest even when the run is interrupted, so finished files are not converted again
+        temp_path = f"{manifest_path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(temp_path, manifest_path)
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Converted {counts['converted']} files, skipped {num_up_to_date} up-to-date files and "
+          f"{counts['insufficient']} files with insufficient data, {len(failed_files)} failed ({elapsed:.2f} s)")
+    if failed_files:
+        print(f"Failed files: {', '.join(failed_files)}")
+
+
+# Function to collect every trajectory below a directory as one LineString record and its point records. With
+# include_points=False only the lines are built (points is None), which needs a fraction of the memory on a whole
+# dataset.
+def collect_trajectory_layers(input_dir, include_points=True):
+    import geopandas as gpd
+    import shapely
 
-                # Check if conversion was successful (enough points to form a LineString)
-                if geojson_output:
-                    # Save the GeoJSON file
-                    with open(output_file, "w") as f:
-                        json.dump(geojson_output, f, indent=2)
-                    print(f"Processed {input_file} -> {output_file}")
-                else:
+    line_records = []
+    line_geometries = []
+    point_frames = []
+    for root, _, files in os.walk(input_dir):
+        for file in files:
+            if file.endswith(".csv"):
+                input_file = os.path.join(root, file)
+                data = load_ais_csv(input_file, columns=GEOJSON_COLUMNS if include_points else LINE_COLUMNS,
+                                    coordinate_dtype="float64", parse_timestamps=False)
+
+                # Filter out rows with missing latitude or longitude only
+                data_filtered = data.dropna(subset=['Latitude', 'Longitude'])
+                if len(data_filtered) < 2:
                     print(f"Skipped {input_file} due to insufficient valid data points.")
+                    continue
+
+                coordinates = data_filtered[['Longitude', 'Latitude']].to_numpy(dtype=float)
+                line_geometries.append(shapely.linestrings(coordinates))
+                line_records.append({
+                    "MMSI": data_filtered['MMSI'].iloc[0],  # Assume MMSI is consistent
+                    "source": os.path.relpath(input_file, input_dir),
+                    "points": len(data_filtered),
+                    "start_time": str(data_filtered['# Timestamp'].iloc[0]),
+                    "end_time": str(data_filtered['# Timestamp'].iloc[-1]),
+                })
+                if not include_points:
+                    continue
+                point_frames.append(pd.DataFrame({
+                    "MMSI": data_filtered['MMSI'].to_numpy(),
+                    "timestamp": data_filtered['# Timestamp'].astype(str).to_numpy(),
+                    "draught": data_filtered['Draught'].astype(float).to_numpy(),
+                    "cog": data_filtered['COG'].astype(float).to_numpy(),
+                    "navigation_status": data_filtered['Navigational status'].astype(str).to_numpy(),
+                    "lon": coordinates[:, 0],
+                    "lat": coordinates[:, 1],
+                }))
+
+    if not line_records:
+        return None, None
+
+    lines = gpd.GeoDataFrame(line_records, geometry=line_geometries, crs="EPSG:4326")
+    if not include_points:
+        return lines, None
+    points = pd.concat(point_frames, ignore_index=True)
+    points = gpd.GeoDataFrame(points.drop(columns=['lon', 'lat']),
+                              geometry=gpd.points_from_xy(points['lon'], points['lat']), crs="EPSG:4326")
+    return lines, points
+
+
+# Function to write all trajectories below a directory into one spatially indexed file: a GeoPackage with a
+# "trajectories" LineString layer and a "points" layer (R-tree index, plus an MMSI index on both layers), or,
+# since a FlatGeobuf file holds a single layer, two FlatGeobuf files with packed Hilbert R-tree indexes
+def export_trajectories(input_dir, output_dir, export_format="gpkg", export_name="trajectories"):
+    lines, points = collect_trajectory_layers(input_dir)
+    if lines is None:
+        print(f"No trajectories with enough valid data points found in {input_dir}")
+        return []
+
+    os.makedirs(output_dir, exist_ok=True)
+    if export_format == "fgb":
+        output_files = [os.path.join(output_dir, f"{export_name}_lines.fgb"),
+                        os.path.join(output_dir, f"{export_name}_points.fgb")]
+        for layer, output_file in zip((lines, points), output_files):
+            layer.to_file(output_file, driver="FlatGeobuf", SPATIAL_INDEX="YES")
+    else:
+        output_file = os.path.join(output_dir, f"{export_name}.gpkg")
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        lines.to_file(output_file, layer="trajectories", driver="GPKG", SPATIAL_INDEX="YES")
+        points.to_file(output_file, layer="points", driver="GPKG", SPATIAL_INDEX="YES")
+
+        # Index the MMSI column so one vessel can be looked up without a table scan
+        with sqlite3.connect(output_file) as connection:
+            connection.execute('CREATE INDEX IF NOT EXISTS "trajectories_mmsi" ON "trajectories" ("MMSI")')
+            connection.execute('CREATE INDEX IF NOT EXISTS "points_mmsi" ON "points" ("MMSI")')
+        output_files = [output_file]
+
+    print(f"Exported {len(lines)} trajectories with {len(points)} points to: {', '.join(output_files)}")
+    return output_files
+
+
+# Function to read only the features of an exported layer that intersect a (minx, miny, maxx, maxy) box
+def read_exported_features(file_path, bbox, layer=None):
+    import geopandas as gpd
+
+    return gpd.read_file(file_path, layer=layer, bbox=bbox)
 
 
-def main():
+def main(argv=None):
     # Set up argument parsing
     parser = argparse.ArgumentParser(
         description="Convert multiple AIS trajectory CSV files to GeoJSON in nested folders.")
     parser.add_argument("input_dir", type=str, help="Path to the root input directory containing CSV files.")
     parser.add_argument("output_dir", type=str, help="Path to the root output directory for GeoJSON files.")
+    parser.add_argument("--output_format", type=str, choices=["pretty", "minified", "seq"], default="pretty",
+                        help="Indented GeoJSON (default), minified GeoJSON, or newline-delimited GeoJSONSeq "
+                             "(RFC 8142, .geojsons).")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes converting files in parallel (default: 1).")
+    parser.add_argument("--force", action="store_true",
+                        help="Convert every file, even those whose GeoJSON is up to date.")
+    parser.add_argument("--export", type=str, choices=["gpkg", "fgb"], default=None,
+                        help="Instead of one GeoJSON per file, export all trajectories into one spatially indexed "
+                             "GeoPackage, or a pair of FlatGeobuf files (lines and points).")
+    parser.add_argument("--export_name", type=str, default="trajectories",
+                        help="Base name of the exported file(s) in the output directory (default: trajectories).")
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
-    # Process the directory
-    process_directory(args.input_dir, args.output_dir)
+    # Export everything into one spatially indexed file, or process the directory file by file
+    if args.export:
+        export_trajectories(args.input_dir, args.output_dir, args.export, args.export_name)
+    else:
+        process_directory(args.input_dir, args.output_dir, args.output_format, args.workers, args.force)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,88 @@
+import os
+import time
+import hashlib
+import pandas as pd
+
+# Shared loader for the aisdk CSV schema (https://web.ais.dk/aisdata/) used by all scripts.
+# It reads only the requested columns, stores the coordinates as float32, keeps the repetitive text
+# columns as categoricals and parses '# Timestamp' once into datetime64.
+
+TIMESTAMP_COLUMN = '# Timestamp'
+AIS_TIMESTAMP_FORMAT = "%d/%m/%Y %H:%M:%S"
+
+COORDINATE_COLUMNS = ['Latitude', 'Longitude']
+CATEGORICAL_COLUMNS = ['Ship type', 'Navigational status', 'Type of mobile']
+
+# Set the environment variable to 1 to compare every typed load against a plain pd.read_csv
+REPORT_ENV_VARIABLE = "AIS_LOADER_REPORT"
+
+
+# Function to build the dtype of each column for read_csv
+def get_ais_dtypes(columns, coordinate_dtype="float32"):
+    dtypes = {}
+    for column in columns:
+        if column in COORDINATE_COLUMNS:
+            dtypes[column] = coordinate_dtype
+        elif column in CATEGORICAL_COLUMNS:
+            dtypes[column] = "category"
+    return dtypes
+
+
+# Function to parse the aisdk timestamps, falling back to day-first inference for files in another format
+def parse_ais_timestamps(values):
+    try:
+        return pd.to_datetime(values, format=AIS_TIMESTAMP_FORMAT)
+    except (ValueError, TypeError):
+        return pd.to_datetime(values, dayfirst=True, errors='coerce')
+
+
+# Function to load an aisdk CSV file with column projection and compact dtypes.
+# Scripts that write the coordinates back out should pass coordinate_dtype="float64", since float32 cannot
+# hold every 6-decimal latitude exactly.
+def load_ais_csv(file_path, columns=None, coordinate_dtype="float32", parse_timestamps=True, report=None):
+    start_time = time.perf_counter()
+
+    # Only read the requested columns that exist in the file
+    header = pd.read_csv(file_path, nrows=0).columns
+    usecols = [column for column in header if columns is None or column in columns]
+
+    data = pd.read_csv(file_path, usecols=usecols, dtype=get_ais_dtypes(usecols, coordinate_dtype))
+
+    # Parse the timestamps once so later steps can work on datetime64 directly
+    if parse_timestamps and TIMESTAMP_COLUMN in data.columns:
+        data[TIMESTAMP_COLUMN] = parse_ais_timestamps(data[TIMESTAMP_COLUMN])
+
+    elapsed = time.perf_counter() - start_time
+    if report is None:
+        report = os.environ.get(REPORT_ENV_VARIABLE) == "1"
+    if report:
+        report_loader_savings(file_path, data, elapsed)
+
+    return data
+
+
+# Function to print the memory and parse time of the typed load next to those of a plain pd.read_csv
+def report_loader_savings(file_path, data, elapsed):
+    start_time = time.perf_counter()
+    baseline = pd.read_csv(file_path)
+    baseline_elapsed = time.perf_counter() - start_time
+
+    memory_mb = data.memory_usage(deep=True).sum() / (1024 * 1024)
+    baseline_memory_mb = baseline.memory_usage(deep=True).sum() / (1024 * 1024)
+    print(f"Loaded {os.path.basename(file_path)}: {memory_mb:.1f} MB in {elapsed:.2f} s "
+          f"(plain read_csv: {baseline_memory_mb:.1f} MB in {baseline_elapsed:.2f} s, "
+          f"saved {baseline_memory_mb - memory_mb:.1f} MB and {baseline_elapsed - elapsed:.2f} s)")
+
+
+# Function to hash the content of a file in blocks, used to tell whether an input changed between runs
+def compute_file_hash(file_path, block_size=1024 * 1024):
+    file_hash = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+# Function to save AIS data with the timestamps written back in the aisdk format
+def save_ais_csv(data, file_path):
+    data.to_csv(file_path, index=False, date_format=AIS_TIMESTAMP_FORMAT)
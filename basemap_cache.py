@@ -0,0 +1,72 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+# Basemap backgrounds for the trajectory plots. All plots of a run share one extent, so the OpenStreetMap
+# background is fetched and warped to EPSG:4326 once, kept in a local cache and drawn under every trajectory.
+# The tiles themselves are cached as well, and in offline mode nothing is downloaded: a background missing from
+# the cache is skipped with a message and the plot is made without it.
+
+DEFAULT_BASEMAP_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ais_basemaps")
+
+
+def get_basemap_source(source=None):
+    if source is None:
+        import contextily as ctx
+        source = ctx.providers.OpenStreetMap.Mapnik
+    return source
+
+
+# Function to get the cache file of the background of an extent
+def get_basemap_cache_path(cache_dir, bounds, source, zoom):
+    url = source.get("url", str(source)) if isinstance(source, dict) else str(source)
+    key = json.dumps([url, [round(float(value), 9) for value in bounds], zoom])
+    return os.path.join(cache_dir, f"basemap_{hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]}.npz")
+
+
+# Function to get the background image (warped to EPSG:4326) and its extent for bounds given as
+# (min_lon, max_lon, min_lat, max_lat), from the cache or, unless offline, from the tile server.
+# Returns None when no background is available.
+def load_basemap(bounds, cache_dir=None, offline=False, source=None, zoom="auto"):
+    if not np.all(np.isfinite(bounds)):
+        return None
+    cache_dir = cache_dir or DEFAULT_BASEMAP_CACHE_DIR
+    source = get_basemap_source(source)
+    cache_path = get_basemap_cache_path(cache_dir, bounds, source, zoom)
+
+    if os.path.isfile(cache_path):
+        with np.load(cache_path) as cached:
+            return cached['image'], tuple(cached['extent'])
+    if offline:
+        print(f"No cached basemap for the extent {bounds} in {cache_dir}, plotting without background (offline)")
+        return None
+
+    import contextily as ctx
+    ctx.set_cache_dir(os.path.join(cache_dir, "tiles"))
+    min_lon, max_lon, min_lat, max_lat = bounds
+    try:
+        image, extent = ctx.bounds2img(min_lon, min_lat, max_lon, max_lat, zoom=zoom, source=source, ll=True)
+        image, extent = ctx.warp_tiles(image, extent, t_crs='EPSG:4326')
+    except Exception as e:
+        print(f"Could not download the basemap, plotting without background: {e}")
+        return None
+
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        np.savez(f, image=image, extent=np.asarray(extent, dtype=np.float64))
+    os.replace(temp_path, cache_path)
+    return image, tuple(extent)
+
+
+# Function to draw a background from load_basemap under the data of an EPSG:4326 axis, keeping the axis limits
+def draw_basemap(ax, basemap):
+    if basemap is None:
+        return
+    image, extent = basemap
+    xmin, xmax, ymin, ymax = ax.axis()
+    if image.shape[2] == 1:
+        image = image[:, :, 0]
+    ax.imshow(image, extent=extent, interpolation='bilinear', aspect=ax.get_aspect())
+    ax.axis((xmin, xmax, ymin, ymax))
@@ -1,95 +1,21 @@
 import os
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from geopy.distance import geodesic
-import geopandas as gpd
-import contextily as ctx
 import random
 import argparse
-
-# Set up argparse to parse NUM_LARGE_GAPS, NUM_SMALL_GAPS, LARGE_GAP_LENGTH_RANGE, and SMALL_GAP_LENGTH_RANGE
-parser = argparse.ArgumentParser(description="Process AIS trajectories with specified gap settings.")
-parser.add_argument("--num_large_gaps", type=int, default=random.randint(1, 4),
-                    help="Number of large gaps to create in the larger part of the trajectory.")
-parser.add_argument("--num_small_gaps", type=int, default=random.randint(10, 20),
-                    help="Number of small gaps to create in the smaller part of the trajectory.")
-parser.add_argument("--large_gap_length_range", type=float, default=random.uniform(100000, 200000),
-                    help="Threshold for large gaps (default: random between 100000 and 200000 meters).")
-parser.add_argument("--small_gap_length_range", type=float, default=random.uniform(10000, 20000),
-                    help="Threshold for small gaps (default: random between 10000 and 20000 meters).")
-parser.add_argument("--min_gap_threshold", type=float, default=random.uniform(10000, 200000),
-                    help="Initial minimum gap threshold (default: random between 50,000 and 200,000)")
-parser.add_argument("--input_dir", type=str, required=False,
-                    default="C:/Users/HU84VR/Downloads/AIS Project1/Test Trajectories for AIS 20240831/25 chosen perfect trajectory data",
-                    help="Directory containing input CSV files with AIS trajectories.")
-parser.add_argument("--output_data_dir", type=str, required=False,
-                    default="C:/Users/HU84VR/Downloads/AIS Project1/Test Trajectories for AIS 20240831/data_combined",
-                    help="Directory to save output CSV files after processing.")
-parser.add_argument("--output_plots_dir", type=str, required=False,
-                    default="C:/Users/HU84VR/Downloads/AIS Project1/Test Trajectories for AIS 20240831/plots/plots_combined",
-                    help="Directory to save output plots.")
-args = parser.parse_args()
-args = parser.parse_args()
-
-# Assign parsed values to variables
-NUM_LARGE_GAPS = args.num_large_gaps
-NUM_SMALL_GAPS = args.num_small_gaps
-LARGE_GAP_LENGTH_RANGE = args.large_gap_length_range
-SMALL_GAP_LENGTH_RANGE = args.small_gap_length_range
-input_dir = args.input_dir
-output_data_dir = args.output_data_dir
-output_plots_dir = args.output_plots_dir
-
-# Verbose output (for informational purposes)
-print(f"Number of large gaps: {NUM_LARGE_GAPS}")
-print(f"Number of small gaps: {NUM_SMALL_GAPS}")
-print(f"Large gap threshold set to: {LARGE_GAP_LENGTH_RANGE}")
-print(f"Small gap threshold set to: {SMALL_GAP_LENGTH_RANGE}")
-print(f"Input directory: {input_dir}")
-print(f"Output data directory: {output_data_dir}")
-print(f"Output plots directory: {output_plots_dir}")
-
-# Define directories (these remain hardcoded as per your specification)
-# input_dir = r"C:/Users/HU84VR/Downloads/AIS Project1/Test Trajectories for AIS 20240831/25 chosen perfect trajectory data"
-# output_data_dir = r"C:/Users/HU84VR/Downloads/AIS Project1/Test Trajectories for AIS 20240831/data_realistic_frequency"
-# output_plots_dir = r"C:/Users/HU84VR/Downloads/AIS Project1/Test Trajectories for AIS 20240831/plots/plots_realistic_frequency"
-
-# Create output directories if they don't exist
-os.makedirs(output_data_dir, exist_ok=True)
-os.makedirs(output_plots_dir, exist_ok=True)
-
-
-# Function to calculate distance between two geographical points using geopy
-def haversine_distance(lat1, lon1, lat2, lon2):
-    point1 = (lat1, lon1)
-    point2 = (lat2, lon2)
-    return geodesic(point1, point2).meters
-
-
-# Function to get the geographical extents (min/max lat/lon) across all files
-def get_global_bounds(input_dir):
-    min_lat, max_lat = np.inf, -np.inf
-    min_lon, max_lon = np.inf, -np.inf
-    for filename in os.listdir(input_dir):
-        if filename.endswith(".csv"):
-            file_path = os.path.join(input_dir, filename)
-            data = pd.read_csv(file_path)
-            min_lat = min(min_lat, data['Latitude'].min())
-            max_lat = max(max_lat, data['Latitude'].max())
-            min_lon = min(min_lon, data['Longitude'].min())
-            max_lon = max(max_lon, data['Longitude'].max())
-    return min_lat, max_lat, min_lon, max_lon
-
-
-# Get global bounds for all the data
-global_min_lat, global_max_lat, global_min_lon, global_max_lon = get_global_bounds(input_dir)
+from ais_loader import load_ais_csv, save_ais_csv
+from trajectory_catalog import get_catalog_bounds
+from gap_intervals import remove_gap_intervals
+from transmission_dropout import DEFAULT_LOSS_PROBABILITY, simulate_transmission_dropout
+from geo_distance import DISTANCE_METHODS, DEFAULT_DISTANCE_METHOD, cached_consecutive_distances, report_distance_error
+from basemap_cache import load_basemap
+from trajectory_plots import get_plot_job, collect_plot_jobs, render_trajectory_plots
 
 
 # Function to split the trajectory based on location point
-def split_trajectory(data):
+def split_trajectory(data, rng=np.random):
     total_length_of_trajectory = data['distance'].sum()
-    split_point = np.random.uniform(0.3, 0.7) * total_length_of_trajectory
+    split_point = rng.uniform(0.3, 0.7) * total_length_of_trajectory
     cumulative_length = data['distance'].cumsum()
 
     # Split the data based on the chosen split point
@@ -100,7 +26,7 @@ def split_trajectory(data):
 
 
 # Function to create gaps in a trajectory with dynamic thresholds and update mechanism
-def create_gaps(data, num_gaps, gap_threshold):
+def create_gaps(data, num_gaps, gap_threshold, rng=np.random):
     gaps = []
     total_length = data['distance'].sum()
     segment_length = total_length / num_gaps
@@ -113,69 +39,157 @@ def create_gaps(data, num_gaps, gap_threshold):
         while segment_end - segment_start < current_gap_threshold:
             current_gap_threshold *= 0.5
 
-        gap_start_location = np.random.uniform(segment_start, segment_end - current_gap_threshold)
-        gap_length = np.random.uniform(current_gap_threshold, segment_end - gap_start_location)
+        gap_start_location = rng.uniform(segment_start, segment_end - current_gap_threshold)
+        gap_length = rng.uniform(current_gap_threshold, segment_end - gap_start_location)
         gaps.append((gap_start_location, gap_start_location + gap_length))
 
-    cumulative_distance = data['distance'].cumsum().reindex(data.index)
-    for gap_start, gap_end in gaps:
-        data = data.loc[(cumulative_distance < gap_start) | (cumulative_distance > gap_end)]
-
-    return data
-
-
-# Process each file in the directory
-for filename in os.listdir(input_dir):
-    if filename.endswith(".csv"):
-        try:
-            print(f"Processing file: {filename}")
-
-            file_path = os.path.join(input_dir, filename)
-            data = pd.read_csv(file_path)
-
-            data['distance'] = np.nan
-            for i in range(1, len(data)):
-                lat1, lon1 = data.loc[i - 1, 'Latitude'], data.loc[i - 1, 'Longitude']
-                lat2, lon2 = data.loc[i, 'Latitude'], data.loc[i, 'Longitude']
-                data.loc[i, 'distance'] = haversine_distance(lat1, lon1, lat2, lon2)
+    # Remove the rows that fall within the gaps, all gaps in one pass
+    cumulative_distance = data['distance'].cumsum()
+    return remove_gap_intervals(data, cumulative_distance, gaps)
+
+
+# Function to create the combined pattern: the trajectory is split at a random point, the larger part gets the
+# large gaps and the smaller part the small gaps. rng is the random generator to draw from, np.random by default.
+def create_combined_gaps(data, num_large_gaps, num_small_gaps, large_gap_length_range, small_gap_length_range,
+                         rng=np.random):
+    larger_part, smaller_part = split_trajectory(data, rng)
+
+    # Apply large and small gaps creation
+    larger_part_with_gaps = create_gaps(larger_part, num_large_gaps, large_gap_length_range, rng)
+    smaller_part_with_gaps = create_gaps(smaller_part, num_small_gaps, small_gap_length_range, rng)
+
+    return pd.concat([smaller_part_with_gaps, larger_part_with_gaps])
+
+
+def main(argv=None):
+    # Set up argparse to parse NUM_LARGE_GAPS, NUM_SMALL_GAPS, LARGE_GAP_LENGTH_RANGE, and SMALL_GAP_LENGTH_RANGE
+    parser = argparse.ArgumentParser(description="Process AIS trajectories with specified gap settings.")
+    parser.add_argument("--num_large_gaps", type=int, default=random.randint(1, 4),
+                        help="Number of large gaps to create in the larger part of the trajectory.")
+    parser.add_argument("--num_small_gaps", type=int, default=random.randint(10, 20),
+                        help="Number of small gaps to create in the smaller part of the trajectory.")
+    parser.add_argument("--large_gap_length_range", type=float, default=random.uniform(100000, 200000),
+                        help="Threshold for large gaps (default: random between 100000 and 200000 meters).")
+    parser.add_argument("--small_gap_length_range", type=float, default=random.uniform(10000, 20000),
+                        help="Threshold for small gaps (default: random between 10000 and 20000 meters).")
+    parser.add_argument("--min_gap_threshold", type=float, default=random.uniform(10000, 200000),
+                        help="Initial minimum gap threshold (default: random between 50,000 and 200,000)")
+    parser.add_argument("--input_dir", type=str, required=False,
+                        default="C:/Users/HU84VR/Downloads/AIS Project1/Test Trajectories for AIS 20240831/25 chosen perfect trajectory data",
+                        help="Directory containing input CSV files with AIS trajectories.")
+    parser.add_argument("--output_data_dir", type=str, required=False,
+                        default="C:/Users/HU84VR/Downloads/AIS Project1/Test Trajectories for AIS 20240831/data_combined",
+                        help="Directory to save output CSV files after processing.")
+    parser.add_argument("--output_plots_dir", type=str, required=False,
+                        default="C:/Users/HU84VR/Downloads/AIS Project1/Test Trajectories for AIS 20240831/plots/plots_combined",
+                        help="Directory to save output plots.")
+    parser.add_argument("--distance_method", choices=DISTANCE_METHODS, default=DEFAULT_DISTANCE_METHOD,
+                        help="Accuracy tier of the distances between consecutive points: exact geodesic (default), "
+                             "vectorized vincenty or spherical haversine.")
+    parser.add_argument("--distance_report", action="store_true",
+                        help="Print the error of the distance method against geopy for each file.")
+    parser.add_argument("--distance_cache_dir", type=str, default=None,
+                        help="Directory of the cached distances of each input file (default: _distance_cache "
+                             "next to the input files).")
+    parser.add_argument("--catalog_dir", type=str, default=None,
+                        help="Directory to keep the catalog of the input directory in (default: next to the input "
+                             "files; a catalog that cannot be written is built in memory).")
+    parser.add_argument("--basemap_cache_dir", type=str, default=None,
+                        help="Directory of the cached basemap tiles and backgrounds (default: ~/.cache/ais_basemaps).")
+    parser.add_argument("--offline", action="store_true",
+                        help="Only use cached basemaps; plots without a cached background are made without it.")
+    parser.add_argument("--transmission_dropout", action="store_true",
+                        help="Also thin the trajectory to the Class A reporting intervals (3 min anchored or moored, "
+                             "10 s at 0-14 kn, 3.33 s when turning, 2 s above 23 kn) with random reception loss.")
+    parser.add_argument("--loss_probability", type=float, default=DEFAULT_LOSS_PROBABILITY,
+                        help="Probability that a scheduled report is not received (with --transmission_dropout).")
+    parser.add_argument("--plot_workers", type=int, default=1,
+                        help="Number of processes rendering the plots (headless, after all CSV files are saved).")
+    plot_stage = parser.add_mutually_exclusive_group()
+    plot_stage.add_argument("--no-plots", action="store_true",
+                            help="Only save the CSV files; the plots can be made later with --plots-only.")
+    plot_stage.add_argument("--plots-only", action="store_true",
+                            help="Only make the plots, from the CSV files already in the output data directory.")
+    args = parser.parse_args(argv)
+
+    # Assign parsed values to variables
+    NUM_LARGE_GAPS = args.num_large_gaps
+    NUM_SMALL_GAPS = args.num_small_gaps
+    LARGE_GAP_LENGTH_RANGE = args.large_gap_length_range
+    SMALL_GAP_LENGTH_RANGE = args.small_gap_length_range
+    input_dir = args.input_dir
+    output_data_dir = args.output_data_dir
+    output_plots_dir = args.output_plots_dir
+    DISTANCE_METHOD = args.distance_method
+
+    # Verbose output (for informational purposes)
+    print(f"Number of large gaps: {NUM_LARGE_GAPS}")
+    print(f"Number of small gaps: {NUM_SMALL_GAPS}")
+    print(f"Large gap threshold set to: {LARGE_GAP_LENGTH_RANGE}")
+    print(f"Small gap threshold set to: {SMALL_GAP_LENGTH_RANGE}")
+    print(f"Input directory: {input_dir}")
+    print(f"Output data directory: {output_data_dir}")
+    print(f"Output plots directory: {output_plots_dir}")
+    print(f"Distance method: {DISTANCE_METHOD}")
+    if args.transmission_dropout:
+        print(f"Transmission dropout with reception loss probability: {args.loss_probability}")
+
+    # Define directories (these remain hardcoded as per your specification)
+    # input_dir = r"C:/Users/HU84VR/Downloads/AIS Project1/Test Trajectories for AIS 20240831/25 chosen perfect trajectory data"
+    # output_data_dir = r"C:/Users/HU84VR/Downloads/AIS Project1/Test Trajectories for AIS 20240831/data_realistic_frequency"
+    # output_plots_dir = r"C:/Users/HU84VR/Downloads/AIS Project1/Test Trajectories for AIS 20240831/plots/plots_realistic_frequency"
+
+    # Create output directories if they don't exist
+    os.makedirs(output_data_dir, exist_ok=True)
+    os.makedirs(output_plots_dir, exist_ok=True)
+
+    # Get global bounds for all the data
+    global_min_lat, global_max_lat, global_min_lon, global_max_lon = get_catalog_bounds(input_dir, args.catalog_dir)
+
+    # Process each file in the directory; the plots are rendered afterwards from the saved CSV files
+    plot_jobs = []
+    input_files = [] if args.plots_only else os.listdir(input_dir)
+    for filename in input_files:
+        if filename.endswith(".csv"):
+            try:
+                print(f"Processing file: {filename}")
 
-            larger_part, smaller_part = split_trajectory(data)
+                file_path = os.path.join(input_dir, filename)
+                data = load_ais_csv(file_path, coordinate_dtype="float64")
 
-            # Apply large and small gaps creation
-            larger_part_with_gaps = create_gaps(larger_part, NUM_LARGE_GAPS, LARGE_GAP_LENGTH_RANGE)
-            smaller_part_with_gaps = create_gaps(smaller_part, NUM_SMALL_GAPS, SMALL_GAP_LENGTH_RANGE)
+                # Calculate distances between consecutive points
+                distances, _ = cached_consecutive_distances(
+                    file_path, data['Latitude'], data['Longitude'], DISTANCE_METHOD, args.distance_cache_dir)
+                data['distance'] = distances
+                if args.distance_report:
+                    report_distance_error(data['Latitude'], data['Longitude'], DISTANCE_METHOD)
 
-            combined_data = pd.concat([smaller_part_with_gaps, larger_part_with_gaps])
-            output_file_path = os.path.join(output_data_dir, filename.replace(".csv", "_gaps_combined.csv"))
-            combined_data.to_csv(output_file_path, index=False)
+                combined_data = create_combined_gaps(data, NUM_LARGE_GAPS, NUM_SMALL_GAPS, LARGE_GAP_LENGTH_RANGE,
+                                                     SMALL_GAP_LENGTH_RANGE)
+                if args.transmission_dropout:
+                    # Keep only the points the transponder would have reported and the receiver picked up
+                    kept = pd.Series(simulate_transmission_dropout(data, args.loss_probability), index=data.index)
+                    combined_data = combined_data[kept.loc[combined_data.index].to_numpy()]
+                output_file_path = os.path.join(output_data_dir, filename.replace(".csv", "_gaps_combined.csv"))
+                save_ais_csv(combined_data, output_file_path)
 
-            fig, ax = plt.subplots(figsize=(10, 10))
-            gdf = gpd.GeoDataFrame(
-                combined_data,
-                geometry=gpd.points_from_xy(combined_data['Longitude'], combined_data['Latitude']),
-                crs="EPSG:4326"
-            )
+                plot_jobs.append(get_plot_job(output_file_path, output_plots_dir, filename))
 
-            gdf.plot(ax=ax, label="Trajectory", color="blue", markersize=5, linewidth=1)
-            ax.set_xlim(global_min_lon, global_max_lon)
-            ax.set_ylim(global_min_lat, global_max_lat)
-            ctx.add_basemap(ax, crs='EPSG:4326', source=ctx.providers.OpenStreetMap.Mapnik)
+                print(f"Successfully processed: {filename}")
 
-            start_point = gdf.iloc[0].geometry
-            end_point = gdf.iloc[-1].geometry
-            ax.scatter([start_point.x], [start_point.y], color="green", s=100, label="Start Point")
-            ax.scatter([end_point.x], [end_point.y], color="red", s=100, label="End Point")
+            except Exception as e:
+                print(f"Error processing file {filename}: {e}")
 
-            plt.title(f"Trajectory Plot - {filename}")
-            plt.legend()
-            plot_file_path = os.path.join(output_plots_dir, filename.replace(".csv", "_trajectory.png"))
-            plt.savefig(plot_file_path)
-            plt.close()
+    if args.plots_only:
+        plot_jobs = collect_plot_jobs(output_data_dir, output_plots_dir, "_gaps_combined.csv")
+    if not args.no_plots:
+        bounds = (global_min_lon, global_max_lon, global_min_lat, global_max_lat)
+        basemap = load_basemap(bounds, args.basemap_cache_dir, args.offline)
+        render_trajectory_plots(plot_jobs, bounds, basemap, args.plot_workers)
 
-            print(f"Successfully processed: {filename}")
 
-        except Exception as e:
-            print(f"Error processing file {filename}: {e}")
+if __name__ == "__main__":
+    main()
 
 # run command
 # python "C:\Users\HU84VR\Downloads\AIS Project1\Test Trajectories for AIS 20240831\combined_random_generator_parsed.py"
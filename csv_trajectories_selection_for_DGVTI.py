@@ -1,7 +1,13 @@
 import os
+import re
+import shutil
+import numpy as np
 import pandas as pd
-from shapely.geometry import Point, Polygon
+import shapely
+from shapely.geometry import Polygon
 import argparse
+from ais_loader import load_ais_csv, get_ais_dtypes
+from trajectory_catalog import load_catalog, query_catalog_bbox
 
 # Define the boundary as a polygon
 boundary_coords = [
@@ -14,37 +20,160 @@ boundary_coords = [
 boundary_polygon = Polygon(boundary_coords)
 
 
-# Function to check if any point in the dataframe is within the boundary
-def contains_points_in_boundary(df, boundary_polygon):
-    for _, row in df.iterrows():
-        point = Point(row['Longitude'], row['Latitude'])
-        if boundary_polygon.contains(point):
+# Number of points tested at once, so a file can stop at the first block with a point inside the boundary
+SELECTION_BLOCK_SIZE = 65536
+
+# Number of rows read at once by the chunked scan of a file
+SCAN_CHUNK_SIZE = 100000
+
+
+# Function to tell whether the boundary is an axis-aligned rectangle, which a bounds test answers exactly
+def is_axis_aligned_box(boundary_polygon):
+    return boundary_polygon.equals(boundary_polygon.envelope)
+
+
+# Function to check if any point in the dataframe is within the boundary. The points are tested block by block
+# against the bounds of the boundary first; only a general polygon needs the exact contains_xy test on the points
+# that pass it. As with Polygon.contains, points on the boundary itself are not inside.
+def contains_points_in_boundary(df, boundary_polygon, block_size=SELECTION_BLOCK_SIZE):
+    longitudes = df['Longitude'].to_numpy(dtype=np.float64)
+    latitudes = df['Latitude'].to_numpy(dtype=np.float64)
+    min_lon, min_lat, max_lon, max_lat = boundary_polygon.bounds
+    is_box = is_axis_aligned_box(boundary_polygon)
+    if not is_box:
+        shapely.prepare(boundary_polygon)
+
+    for start in range(0, len(longitudes), block_size):
+        lon = longitudes[start:start + block_size]
+        lat = latitudes[start:start + block_size]
+        inside = (lon > min_lon) & (lon < max_lon) & (lat > min_lat) & (lat < max_lat)
+        if not is_box and inside.any():
+            inside = shapely.contains_xy(boundary_polygon, lon[inside], lat[inside])
+        if inside.any():
             return True
     return False
 
 
-def main(input_dir, output_dir):
+# Function to check if a file has any point within the boundary. Only the coordinate columns are read, chunk by
+# chunk, and the scan stops at the first chunk with a point inside; chunk_size 0 reads the whole file at once.
+# The coordinates are read as float64, since float32 rounding can move points near the boundary in or out.
+def file_has_points_in_boundary(file_path, boundary_polygon, chunk_size=SCAN_CHUNK_SIZE):
+    columns = ['Longitude', 'Latitude']
+    if not set(columns).issubset(pd.read_csv(file_path, nrows=0).columns):
+        return False
+    if chunk_size <= 0:
+        return contains_points_in_boundary(load_ais_csv(file_path, columns=columns, coordinate_dtype="float64"),
+                                           boundary_polygon)
+
+    dtypes = get_ais_dtypes(columns, coordinate_dtype="float64")
+    with pd.read_csv(file_path, usecols=columns, dtype=dtypes, chunksize=chunk_size) as reader:
+        for chunk in reader:
+            if contains_points_in_boundary(chunk, boundary_polygon):
+                return True
+    return False
+
+
+# Function to put a selected file into the output directory: as a hard link, as a byte copy, or rewritten
+# through pandas as before
+def copy_selected_file(file_path, output_path, copy_mode="copy"):
+    if copy_mode == "rewrite":
+        # The full file is loaded with float64 coordinates and the timestamps as text so it is written back
+        # (nearly) unchanged
+        df = load_ais_csv(file_path, coordinate_dtype="float64", parse_timestamps=False)
+        df.to_csv(output_path, index=False)
+        return
+
+    if os.path.lexists(output_path):
+        os.remove(output_path)
+    if copy_mode == "hardlink":
+        try:
+            os.link(file_path, output_path)
+            return
+        except OSError:
+            pass  # Different file system or no link support, copy the bytes instead
+    shutil.copyfile(file_path, output_path)
+
+
+# Function to copy the trajectories with points within the boundary to the output directory
+def select_trajectories(input_dir, output_dir, chunk_size=SCAN_CHUNK_SIZE, copy_mode="copy", catalog_dir=None):
     # Ensure the output directory exists
     os.makedirs(output_dir, exist_ok=True)
 
-    # Iterate over all CSV files in the directory
-    for file_name in os.listdir(input_dir):
-        if file_name.endswith('.csv'):
-            file_path = os.path.join(input_dir, file_name)
+    # Only the files whose extent in the catalog intersects the boundary can have points within it. If the
+    # boundary is a box and the whole extent lies inside it, the file is selected without reading its points.
+    candidates = query_catalog_bbox(input_dir, *boundary_polygon.bounds, catalog_dir=catalog_dir)
+    is_box = is_axis_aligned_box(boundary_polygon)
 
-            # Load CSV file
-            df = pd.read_csv(file_path)
+    for file_name, within in zip(candidates['file'], candidates['within']):
+        file_path = os.path.join(input_dir, file_name)
 
-            # Check if the dataframe contains any points within the boundary
-            if 'Longitude' in df.columns and 'Latitude' in df.columns:
-                if contains_points_in_boundary(df, boundary_polygon):
-                    # Save the file to the output directory if it has points within the boundary
-                    df.to_csv(os.path.join(output_dir, file_name), index=False)
+        # Check if the file contains any points within the boundary
+        if (is_box and within) or file_has_points_in_boundary(file_path, boundary_polygon, chunk_size):
+            # Save the file to the output directory if it has points within the boundary
+            copy_selected_file(file_path, os.path.join(output_dir, file_name), copy_mode)
 
     print("Filtering complete. Selected files are saved in the output directory.")
 
 
-if __name__ == "__main__":
+# Function to load the grid cells (cells.txt, read by run_v2.py with index_col='cell_id') as polygons. A cell is
+# given either as WKT in a geometry column or by its longitude/latitude bounds.
+def load_cells(cells_file):
+    cells_data = pd.read_csv(cells_file, index_col='cell_id')
+    names = {re.sub('[^a-z]', '', column.lower()): column for column in cells_data.columns}
+    for name in ('geometry', 'wkt', 'polygon'):
+        if name in names:
+            return pd.Series(shapely.from_wkt(cells_data[names[name]].to_numpy()), index=cells_data.index)
+
+    bounds = []
+    for extreme, axis in (('min', 'lon'), ('min', 'lat'), ('max', 'lon'), ('max', 'lat')):
+        matches = [column for name, column in names.items() if extreme in name and axis in name]
+        if len(matches) != 1:
+            raise ValueError(f"Cannot find the {extreme} {axis} column of the cells in {cells_file}")
+        bounds.append(cells_data[matches[0]].to_numpy(dtype=np.float64))
+    return pd.Series(shapely.box(*bounds), index=cells_data.index)
+
+
+# Function to assign every trajectory to all grid cells it has points in, in one pass over the files. The cells
+# are indexed in an STRtree; files whose catalog extent touches no cell are not read at all. The mapping
+# (file, MMSI, cell_id, points) is written to mapping_file.
+def select_by_cells(input_dir, cells_file, mapping_file, catalog_dir=None):
+    cells = load_cells(cells_file)
+    tree = shapely.STRtree(cells.to_numpy())
+
+    # Files that failed to scan have no extent and are always read
+    catalog = load_catalog(input_dir, catalog_dir=catalog_dir)
+    failed = catalog['error'].notna()
+    scanned = catalog.loc[~failed].dropna(subset=['min_lon', 'min_lat', 'max_lon', 'max_lat'])
+    extents = shapely.box(scanned['min_lon'], scanned['min_lat'], scanned['max_lon'], scanned['max_lat'])
+    candidate_rows = np.unique(tree.query(extents, predicate='intersects')[0])
+    candidates = pd.concat([scanned.iloc[candidate_rows], catalog.loc[failed]])
+
+    mapping = []
+    for file_name, mmsi in zip(candidates['file'], candidates['MMSI']):
+        try:
+            df = load_ais_csv(os.path.join(input_dir, file_name), columns=['Longitude', 'Latitude'],
+                              coordinate_dtype="float64")
+            points = shapely.points(df['Longitude'].to_numpy(dtype=np.float64),
+                                    df['Latitude'].to_numpy(dtype=np.float64))
+
+            # As with Polygon.contains, only points strictly inside a cell count
+            _, cell_indices = tree.query(points, predicate='within')
+            cell_positions, counts = np.unique(cell_indices, return_counts=True)
+            for position, count in zip(cell_positions, counts):
+                mapping.append({'file': file_name, 'MMSI': mmsi, 'cell_id': cells.index[position],
+                                'points': int(count)})
+        except Exception as e:
+            print(f"Error processing file {file_name}: {e}")
+
+    mapping = pd.DataFrame(mapping, columns=['file', 'MMSI', 'cell_id', 'points'])
+    os.makedirs(os.path.dirname(os.path.abspath(mapping_file)), exist_ok=True)
+    mapping.to_csv(mapping_file, index=False)
+    print(f"Assigned {mapping['file'].nunique()} of {len(catalog)} trajectories to {mapping['cell_id'].nunique()} "
+          f"of {len(cells)} cells. Mapping saved to: {mapping_file}")
+    return mapping
+
+
+def main(argv=None):
     parser = argparse.ArgumentParser(description="Filter trajectory CSV files by geographic boundary")
     parser.add_argument('--input_dir', type=str,
                         default=r'G:\AIS_Project1\AIS_Data_Class_A\10_ship_type\aisdk-2024-10-31\Cargo',
@@ -52,8 +181,31 @@ if __name__ == "__main__":
     parser.add_argument('--output_dir', type=str,
                         default=r'G:\AIS_Project1\AIS_Data_Class_A\10_ship_type\aisdk-2024-10-31\Cargo_csv_selected',
                         help="Directory to save selected CSV files")
+    parser.add_argument('--cells_file', type=str, default=None,
+                        help="Grid of cells (cells.txt); assigns every trajectory to the cells it has points in "
+                             "instead of filtering by the single boundary")
+    parser.add_argument('--mapping_file', type=str, default=None,
+                        help="Where to write the trajectory to cells mapping (default: "
+                             "<output_dir>/trajectory_cells.txt)")
+    parser.add_argument('--chunk_size', type=int, default=SCAN_CHUNK_SIZE,
+                        help="Rows read at once when scanning a file for points within the boundary; "
+                             "0 reads the whole file")
+    parser.add_argument('--copy_mode', choices=['copy', 'hardlink', 'rewrite'], default='copy',
+                        help="How selected files are saved: byte copy, hard link (shares the file with the input, "
+                             "falls back to a copy) or rewritten through pandas")
+    parser.add_argument('--catalog_dir', type=str, default=None,
+                        help="Directory to keep the catalog of the input directory in (default: next to the "
+                             "files; a catalog that cannot be written is built in memory)")
 
-    args = parser.parse_args()
-    main(args.input_dir, args.output_dir)
+    args = parser.parse_args(argv)
+    if args.cells_file:
+        mapping_file = args.mapping_file or os.path.join(args.output_dir, 'trajectory_cells.txt')
+        select_by_cells(args.input_dir, args.cells_file, mapping_file, args.catalog_dir)
+    else:
+        select_trajectories(args.input_dir, args.output_dir, args.chunk_size, args.copy_mode, args.catalog_dir)
+
+
+if __name__ == "__main__":
+    main()
 
 # python script_name.py --input_dir "your_input_path" --output_dir "your_output_path"
\ No newline at end of file
@@ -0,0 +1,36 @@
+import numpy as np
+
+# Removal of gaps given as (start, end) intervals of cumulative distance along a trajectory. The cumulative distance
+# never decreases, so every interval is turned into the index range of the points it covers with one searchsorted,
+# and the points to keep are marked in a single pass over the trajectory: O(n + g log n) for n points and g gaps,
+# with one copy of the data instead of one per gap.
+
+
+# Function to get the mask of the points outside all gaps. A point is removed when start <= distance <= end for any
+# gap; points without a cumulative distance (NaN) are removed as well as soon as there is a gap, since they never
+# compare as outside one.
+def get_kept_mask(cumulative_distance, gaps):
+    cumulative_distance = np.asarray(cumulative_distance, dtype=np.float64)
+    gaps = np.asarray(gaps, dtype=np.float64).reshape(-1, 2)
+    if len(gaps) == 0:
+        return np.ones(len(cumulative_distance), dtype=bool)
+
+    kept = ~np.isnan(cumulative_distance)
+    valid = np.flatnonzero(kept)
+    values = cumulative_distance[valid]
+
+    # Index range [first, last) of the points inside each gap
+    first = np.searchsorted(values, gaps[:, 0], side='left')
+    last = np.maximum(np.searchsorted(values, gaps[:, 1], side='right'), first)
+
+    # Mark the ranges with +1/-1 at their ends, a point is inside a gap where the running sum is positive
+    boundaries = np.zeros(len(values) + 1, dtype=np.int64)
+    np.add.at(boundaries, first, 1)
+    np.add.at(boundaries, last, -1)
+    kept[valid[np.cumsum(boundaries[:-1]) > 0]] = False
+    return kept
+
+
+# Function to remove the points of a trajectory that fall within the gaps
+def remove_gap_intervals(data, cumulative_distance, gaps):
+    return data[get_kept_mask(cumulative_distance, gaps)]
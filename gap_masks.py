@@ -0,0 +1,99 @@
+import os
+import numpy as np
+from ais_loader import load_ais_csv, compute_file_hash
+
+# Ground-truth gap masks. Instead of a full copy of the trajectory minus the removed rows, a scenario can be stored
+# as the rows removed from its source file: a list of [start, end) row ranges, or a packed bitmap of the removed rows
+# when that is smaller (e.g. after a transmission dropout, which removes scattered rows). A mask is a few hundred
+# bytes, keeps exactly which rows were removed, and is tied to its source file by row count and content hash. The
+# sparse trajectory is rebuilt by selecting the kept rows of the original, which can be read once and shared by all
+# scenarios of the file.
+
+GAP_MASK_SUFFIX = ".gaps.npz"
+
+
+# Function to get the mask file that replaces a scenario CSV file
+def get_gap_mask_path(output_file_path):
+    return os.path.splitext(output_file_path)[0] + GAP_MASK_SUFFIX
+
+
+# Function to get the mask of the rows of the original data (positions) still present in the sparse data
+def get_kept_mask_from_index(original_index, sparse_index):
+    kept = np.zeros(len(original_index), dtype=bool)
+    positions = original_index.get_indexer(sparse_index)
+    if (positions < 0).any():
+        raise ValueError("The sparse data has rows that are not in the original data")
+    kept[positions] = True
+    return kept
+
+
+# Function to get the [start, end) row ranges of the removed rows from the mask of the kept rows
+def get_removed_ranges(kept):
+    removed = np.concatenate([[0], (~np.asarray(kept, dtype=bool)).astype(np.int8), [0]])
+    return np.flatnonzero(np.diff(removed)).reshape(-1, 2)
+
+
+# Function to get the mask of the kept rows from the removed row ranges
+def get_kept_mask_from_ranges(removed_ranges, points):
+    boundaries = np.zeros(points + 1, dtype=np.int64)
+    np.add.at(boundaries, removed_ranges[:, 0], 1)
+    np.add.at(boundaries, removed_ranges[:, 1], -1)
+    return np.cumsum(boundaries[:-1]) == 0
+
+
+# Function to save the gap mask of a scenario of source_path, given the mask of its kept rows. The source hash can
+# be passed in when many scenarios of the same file are saved.
+def save_gap_mask(mask_path, kept, source_path, source_hash=None):
+    kept = np.asarray(kept, dtype=bool)
+    removed_ranges = get_removed_ranges(kept)
+    removed_ranges = removed_ranges.astype(np.uint32 if len(kept) < 2 ** 32 else np.int64)
+    arrays = {
+        "points": np.int64(len(kept)),
+        "source_file": np.str_(os.path.basename(source_path)),
+        "source_path": np.str_(os.path.abspath(source_path)),
+        "source_hash": np.str_(source_hash or compute_file_hash(source_path)),
+    }
+    if removed_ranges.nbytes <= (len(kept) + 7) // 8:
+        arrays["removed_ranges"] = removed_ranges
+    else:
+        arrays["removed_bitmap"] = np.packbits(~kept)
+
+    temp_path = f"{mask_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(temp_path, mask_path)
+
+
+# Function to load a gap mask: the source file, its row count and hash, the mask of the kept rows and the removed
+# row ranges
+def load_gap_mask(mask_path):
+    with np.load(mask_path) as stored:
+        points = int(stored["points"])
+        if "removed_ranges" in stored:
+            removed_ranges = stored["removed_ranges"].astype(np.int64).reshape(-1, 2)
+            kept = get_kept_mask_from_ranges(removed_ranges, points)
+        else:
+            kept = ~np.unpackbits(stored["removed_bitmap"], count=points).astype(bool)
+            removed_ranges = get_removed_ranges(kept)
+        return {"source_file": str(stored["source_file"]), "source_path": str(stored["source_path"]),
+                "source_hash": str(stored["source_hash"]), "points": points, "kept": kept,
+                "removed_ranges": removed_ranges}
+
+
+# Function to rebuild the sparse trajectory of a gap mask from its original. The original is read from source_dir
+# (by default the directory it was in when the mask was saved) and checked against the hash of the mask, unless the
+# already loaded original is passed as data.
+def read_sparse_trajectory(mask_path, source_dir=None, data=None, verify=True):
+    gap_mask = load_gap_mask(mask_path)
+    if data is None:
+        if source_dir is None:
+            source_path = gap_mask["source_path"]
+        else:
+            source_path = os.path.join(source_dir, gap_mask["source_file"])
+        if verify and compute_file_hash(source_path) != gap_mask["source_hash"]:
+            raise ValueError(f"{source_path} changed since the gap mask {mask_path} was saved")
+        data = load_ais_csv(source_path, coordinate_dtype="float64")
+
+    if len(data) != gap_mask["points"]:
+        raise ValueError(f"The gap mask {mask_path} is for {gap_mask['points']} rows, the original has {len(data)}")
+    return data[gap_mask["kept"]]
@@ -0,0 +1,225 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+import itertools
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from ais_loader import AIS_TIMESTAMP_FORMAT, load_ais_csv, save_ais_csv, compute_file_hash
+from gap_masks import get_gap_mask_path, get_kept_mask_from_index, save_gap_mask
+from geo_distance import DISTANCE_METHODS, DEFAULT_DISTANCE_METHOD, cached_consecutive_distances
+
+# Batch scenario sweep for the gap generators. Every trajectory is read (and its distances measured) once, then
+# the whole parameter grid x replicates is generated in-process, one input file per worker. The random generator
+# of every scenario is seeded from (seed, generator, parameters, replicate, file), so a scenario is reproduced
+# exactly whatever the worker count or the order in which the files are processed. The generators only remove rows,
+# so the CSV rows of a file are formatted once and every scenario is written by selecting its rows; formatting the
+# timestamps and floats again for every scenario took most of the sweep time. In the mask output mode a scenario is
+# stored as the rows removed from its input file (see gap_masks.py) instead of a full CSV copy.
+#
+# Workers run whole input files, the largest first, in separate processes. They only shorten the sweep when there
+# are several input files and as many free CPU cores; on a single core, or with one file much larger than the rest,
+# a sweep takes as long as with one worker.
+
+SWEEP_MANIFEST_FILENAME = "_sweep_manifest.csv"
+OUTPUT_MODES = ("csv", "mask")
+
+# Parameters of each generator and the suffix of its output files
+GENERATOR_PARAMETERS = {
+    "single": ["min_gap_threshold"],
+    "multiple": ["num_gaps", "min_gap_threshold"],
+    "combined": ["num_large_gaps", "num_small_gaps", "large_gap_length_range", "small_gap_length_range"],
+}
+GENERATOR_SUFFIXES = {
+    "single": "_single_gap.csv",
+    "multiple": "_multiple_gaps.csv",
+    "combined": "_gaps_combined.csv",
+}
+
+
+# Function to derive the seed of one scenario from the base seed, the scenario parameters and the input file
+def derive_seed(seed, generator, params, replicate, filename):
+    key = json.dumps([seed, generator, sorted(params.items()), replicate, filename])
+    return int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:8], "little")
+
+
+# Function to format a parameter value as in the scenario directory names and the manifest, e.g. 50000 for 50000.0
+def format_parameter(value):
+    return f"{value:g}"
+
+
+# Function to get the directory name of a parameter combination, e.g. num_gaps=5_min_gap_threshold=50000
+def get_scenario_name(params):
+    return "_".join(f"{name}={format_parameter(value)}" for name, value in params.items())
+
+
+# Function to build the list of parameter combinations of a generator from the swept values
+def build_parameter_grid(generator, values):
+    names = GENERATOR_PARAMETERS[generator]
+    return [dict(zip(names, combination)) for combination in itertools.product(*(values[name] for name in names))]
+
+
+# Function to create the gaps of one scenario with the functions of the generator scripts
+def create_scenario(generator, data, cumulative_distances, params, rng, filename):
+    if generator == "single":
+        from single_random_generator_parsed import create_single_gap
+        return create_single_gap(data, cumulative_distances, params["min_gap_threshold"], filename, rng)
+    if generator == "multiple":
+        from multiple_random_generator_parsed import create_gaps
+        return create_gaps(data, params["num_gaps"], params["min_gap_threshold"], rng)
+    from combined_random_generator_parsed import create_combined_gaps
+    return create_combined_gaps(data, params["num_large_gaps"], params["num_small_gaps"],
+                                params["large_gap_length_range"], params["small_gap_length_range"], rng)
+
+
+# Function to format the CSV rows of a trajectory once, as save_ais_csv writes them. Returns the header and the
+# encoded rows, or None when a row cannot be told apart (a quoted line break).
+def render_csv_rows(data):
+    lines = data.to_csv(index=False, date_format=AIS_TIMESTAMP_FORMAT, lineterminator="\n").split("\n")
+    if len(lines) != len(data) + 2:
+        return None
+    rows = np.array([f"{line}{os.linesep}".encode("utf-8") for line in lines[1:-1]], dtype=object)
+    return f"{lines[0]}{os.linesep}".encode("utf-8"), rows
+
+
+# Function to save a scenario by selecting its rows from the rendered rows of its input file, with save_ais_csv
+# when it is not a subset of the input rows
+def save_scenario_csv(data_with_gaps, data, rendered_rows, output_file_path):
+    if rendered_rows is not None and list(data_with_gaps.columns) == list(data.columns):
+        positions = data.index.get_indexer(data_with_gaps.index)
+        if (positions >= 0).all():
+            header, rows = rendered_rows
+            with open(output_file_path, "wb") as f:
+                f.write(header)
+                f.write(b"".join(rows[positions]))
+            return
+    save_ais_csv(data_with_gaps, output_file_path)
+
+
+# Function to generate every scenario of one input file, returns one manifest record per scenario
+def sweep_file(file_path, output_dir, generators, grids, replicates, seed, distance_method=DEFAULT_DISTANCE_METHOD,
+               distance_cache_dir=None, output_mode="csv"):
+    filename = os.path.basename(file_path)
+
+    # Read and measure the trajectory once for the whole grid
+    data = load_ais_csv(file_path, coordinate_dtype="float64")
+    distances, cumulative_distances = cached_consecutive_distances(
+        file_path, data['Latitude'], data['Longitude'], distance_method, distance_cache_dir)
+    data['distance'] = distances
+    source_hash = compute_file_hash(file_path) if output_mode == "mask" else None
+    rendered_rows = render_csv_rows(data) if output_mode == "csv" else None
+
+    records = []
+    for generator in generators:
+        for params in grids[generator]:
+            for replicate in range(replicates):
+                scenario_seed = derive_seed(seed, generator, params, replicate, filename)
+                rng = np.random.default_rng(scenario_seed)
+                data_with_gaps = create_scenario(generator, data, cumulative_distances, params, rng, filename)
+
+                scenario_dir = os.path.join(output_dir, generator, get_scenario_name(params), f"rep{replicate:03d}")
+                os.makedirs(scenario_dir, exist_ok=True)
+                output_file_path = os.path.join(scenario_dir, filename.replace(".csv", GENERATOR_SUFFIXES[generator]))
+                if output_mode == "mask":
+                    output_file_path = get_gap_mask_path(output_file_path)
+                    kept = get_kept_mask_from_index(data.index, data_with_gaps.index)
+                    save_gap_mask(output_file_path, kept, file_path, source_hash)
+                else:
+                    save_scenario_csv(data_with_gaps, data, rendered_rows, output_file_path)
+
+                # The parameters are written as in the directory names, whatever their type
+                parameters = {name: format_parameter(value) for name, value in params.items()}
+                records.append({"generator": generator, **parameters, "replicate": replicate, "file": filename,
+                                "seed": scenario_seed, "points": len(data), "points_kept": len(data_with_gaps),
+                                "output_file": os.path.relpath(output_file_path, output_dir)})
+    return records
+
+
+# Function to run the sweep over all CSV files of input_dir on a pool of workers
+def run_sweep(input_dir, output_dir, generators, values, replicates=1, seed=0, workers=1,
+              distance_method=DEFAULT_DISTANCE_METHOD, distance_cache_dir=None, output_mode="csv"):
+    start_time = time.perf_counter()
+    grids = {generator: build_parameter_grid(generator, values) for generator in generators}
+    file_paths = [os.path.join(input_dir, filename) for filename in sorted(os.listdir(input_dir))
+                  if filename.endswith(".csv")]
+    scenario_count = sum(len(grid) for grid in grids.values()) * replicates
+    print(f"Sweeping {len(file_paths)} files x {scenario_count} scenarios with {workers} worker(s)")
+
+    os.makedirs(output_dir, exist_ok=True)
+    records = []
+    arguments = (output_dir, generators, grids, replicates, seed, distance_method, distance_cache_dir, output_mode)
+    if workers > 1:
+        # The largest files start first, so that none of them is left running alone at the end
+        file_paths = sorted(file_paths, key=os.path.getsize, reverse=True)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(sweep_file, file_path, *arguments): file_path for file_path in file_paths}
+            for future in as_completed(futures):
+                try:
+                    records.extend(future.result())
+                except Exception as e:
+                    print(f"Error processing file {os.path.basename(futures[future])}: {e}")
+    else:
+        for file_path in file_paths:
+            try:
+                records.extend(sweep_file(file_path, *arguments))
+            except Exception as e:
+                print(f"Error processing file {os.path.basename(file_path)}: {e}")
+
+    parameter_columns = list(dict.fromkeys(name for generator in generators
+                                           for name in GENERATOR_PARAMETERS[generator]))
+    manifest = pd.DataFrame(records, columns=["generator", *parameter_columns, "replicate", "file", "seed", "points",
+                                              "points_kept", "output_file"])
+    if not manifest.empty:
+        manifest = manifest.sort_values(["generator", "output_file"], kind="stable")
+    manifest_path = os.path.join(output_dir, SWEEP_MANIFEST_FILENAME)
+    manifest.to_csv(manifest_path, index=False)
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Generated {len(manifest)} scenario files in {elapsed:.2f} s. Manifest saved to: {manifest_path}")
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a grid of gap scenarios x replicates for each trajectory.")
+    parser.add_argument("--input_dir", type=str, required=True,
+                        help="Directory containing input CSV files with AIS trajectories.")
+    parser.add_argument("--output_dir", type=str, required=True,
+                        help="Directory to save the scenarios, as <generator>/<parameters>/rep<k>/.")
+    parser.add_argument("--generators", nargs="+", choices=list(GENERATOR_PARAMETERS), default=["multiple"],
+                        help="Gap generators to sweep.")
+    parser.add_argument("--replicates", type=int, default=1, help="Number of replicates of every parameter combination.")
+    parser.add_argument("--seed", type=int, default=0, help="Base seed the seed of every scenario is derived from.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes, one input file at a time each. Only faster with several input "
+                             "files and as many free CPU cores; with one core or one large file it is not.")
+    parser.add_argument("--min_gap_threshold", type=float, nargs="+", default=[50000.0],
+                        help="Minimum gap thresholds (meters) of the single and multiple generators.")
+    parser.add_argument("--num_gaps", type=int, nargs="+", default=[5],
+                        help="Numbers of gaps of the multiple generator.")
+    parser.add_argument("--num_large_gaps", type=int, nargs="+", default=[2],
+                        help="Numbers of large gaps of the combined generator.")
+    parser.add_argument("--num_small_gaps", type=int, nargs="+", default=[15],
+                        help="Numbers of small gaps of the combined generator.")
+    parser.add_argument("--large_gap_length_range", type=float, nargs="+", default=[150000.0],
+                        help="Large gap thresholds (meters) of the combined generator.")
+    parser.add_argument("--small_gap_length_range", type=float, nargs="+", default=[15000.0],
+                        help="Small gap thresholds (meters) of the combined generator.")
+    parser.add_argument("--distance_method", choices=DISTANCE_METHODS, default=DEFAULT_DISTANCE_METHOD,
+                        help="Accuracy tier of the distances between consecutive points.")
+    parser.add_argument("--distance_cache_dir", type=str, default=None,
+                        help="Directory of the cached distances of each input file (default: _distance_cache "
+                             "next to the input files).")
+    parser.add_argument("--output_mode", choices=OUTPUT_MODES, default="csv",
+                        help="Save every scenario as a CSV file (default) or as a compact mask of the rows removed "
+                             "from its input file, read back with gap_masks.read_sparse_trajectory.")
+    args = parser.parse_args(argv)
+
+    values = {name: getattr(args, name) for parameters in GENERATOR_PARAMETERS.values() for name in parameters}
+    run_sweep(args.input_dir, args.output_dir, args.generators, values, args.replicates, args.seed, args.workers,
+              args.distance_method, args.distance_cache_dir, args.output_mode)
+
+
+if __name__ == "__main__":
+    main()
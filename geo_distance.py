@@ -0,0 +1,187 @@
+import os
+import time
+import numpy as np
+from ais_loader import compute_file_hash
+
+# Distances between consecutive AIS positions, computed over whole columns instead of one geopy call per row.
+# Three accuracy tiers are available:
+#   geodesic  - exact ellipsoidal distance on WGS-84 (Karney, the algorithm behind geopy.distance.geodesic), the
+#               default since it gives the same distances as the original per-row geopy loop
+#   vincenty  - vectorized Vincenty inverse formula on WGS-84, sub-millimetre agreement with geodesic
+#   haversine - spherical distance, fastest, errors of up to about 0.5%
+# report_distance_error compares a tier against geopy on a sample of the pairs. The distances of a source file can
+# be kept in a sidecar cache keyed by the file hash, so repeated gap-generation runs skip the distance stage.
+
+DISTANCE_METHODS = ("geodesic", "vincenty", "haversine")
+DEFAULT_DISTANCE_METHOD = "geodesic"
+
+DISTANCE_CACHE_DIRNAME = "_distance_cache"
+
+EARTH_RADIUS_M = 6371008.8
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+
+
+def as_float_arrays(*values):
+    return tuple(np.asarray(v, dtype=np.float64) for v in values)
+
+
+# Function to calculate haversine distances (meters) between arrays of points
+def haversine_meters(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(v) for v in as_float_arrays(lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+# Function to calculate the exact ellipsoidal distances (meters) between arrays of points, pair by pair. The
+# ellipsoid is set up in kilometers like geopy does, so the results match geopy.distance.geodesic to the bit.
+def geodesic_meters(lat1, lon1, lat2, lon2):
+    from geographiclib.geodesic import Geodesic
+
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(*as_float_arrays(lat1, lon1, lat2, lon2))
+    distances = np.full(lat1.shape, np.nan)
+    valid = ~(np.isnan(lat1) | np.isnan(lon1) | np.isnan(lat2) | np.isnan(lon2))
+    inverse = Geodesic(WGS84_A / 1000, WGS84_F).Inverse
+    distances[valid] = [inverse(a, b, c, d, Geodesic.DISTANCE)['s12'] * 1000
+                        for a, b, c, d in zip(lat1[valid], lon1[valid], lat2[valid], lon2[valid])]
+    return distances
+
+
+# Function to calculate ellipsoidal distances (meters) between arrays of points with Vincenty's inverse formula.
+# The few nearly antipodal pairs for which the iteration does not converge fall back to the exact geodesic.
+def vincenty_meters(lat1, lon1, lat2, lon2, max_iterations=200, tolerance=1e-12):
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(*as_float_arrays(lat1, lon1, lat2, lon2))
+    f = WGS84_F
+    L = np.radians(lon2 - lon1)
+    U1 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    U2 = np.arctan((1 - f) * np.tan(np.radians(lat2)))
+    sin_U1, cos_U1 = np.sin(U1), np.cos(U1)
+    sin_U2, cos_U2 = np.sin(U2), np.cos(U2)
+
+    lam = L
+    converged = np.zeros(L.shape, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(max_iterations):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cos_U2 * sin_lam, cos_U1 * sin_U2 - sin_U1 * cos_U2 * cos_lam)
+            cos_sigma = sin_U1 * sin_U2 + cos_U1 * cos_U2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_U1 * cos_U2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            # Lines along the equator have cos2_alpha == 0
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_U1 * sin_U2 / cos2_alpha)
+            C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+            previous_lam = lam
+            lam = L + (1 - C) * f * sin_alpha * (
+                sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+            converged = ~(np.abs(lam - previous_lam) > tolerance)  # NaN pairs count as converged
+            if converged.all():
+                break
+
+        u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+        A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+        B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+        delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+            - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+        distances = WGS84_B * A * (sigma - delta_sigma)
+
+    if not converged.all():
+        distances[~converged] = geodesic_meters(lat1[~converged], lon1[~converged],
+                                                lat2[~converged], lon2[~converged])
+    return distances
+
+
+DISTANCE_FUNCTIONS = {
+    "geodesic": geodesic_meters,
+    "vincenty": vincenty_meters,
+    "haversine": haversine_meters,
+}
+
+
+# Function to calculate the distances (meters) between arrays of points with the chosen accuracy tier
+def pairwise_distances(lat1, lon1, lat2, lon2, method=DEFAULT_DISTANCE_METHOD):
+    if method not in DISTANCE_FUNCTIONS:
+        raise ValueError(f"Unknown distance method {method!r}, expected one of {DISTANCE_METHODS}")
+    return DISTANCE_FUNCTIONS[method](lat1, lon1, lat2, lon2)
+
+
+# Function to calculate the distance (meters) from every point to the one before it, NaN for the first point
+def consecutive_distances(latitudes, longitudes, method=DEFAULT_DISTANCE_METHOD):
+    latitudes, longitudes = as_float_arrays(latitudes, longitudes)
+    distances = np.full(len(latitudes), np.nan)
+    if len(latitudes) > 1:
+        distances[1:] = pairwise_distances(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:], method)
+    return distances
+
+
+# Function to get the sidecar cache file of a source file and distance method; by default the cache lives in a
+# _distance_cache directory next to the source file
+def get_distance_cache_path(file_path, method=DEFAULT_DISTANCE_METHOD, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(file_path)), DISTANCE_CACHE_DIRNAME)
+    return os.path.join(cache_dir, f"{compute_file_hash(file_path)}_{method}.npz")
+
+
+# Function to get the consecutive distances and the cumulative distance (meters, NaN for the first point as with
+# pandas cumsum) of a source file, read from its sidecar cache when the file content is unchanged
+def cached_consecutive_distances(file_path, latitudes, longitudes, method=DEFAULT_DISTANCE_METHOD, cache_dir=None):
+    cache_path = get_distance_cache_path(file_path, method, cache_dir)
+    if os.path.isfile(cache_path):
+        try:
+            with np.load(cache_path) as cached:
+                if len(cached['distance']) == len(latitudes):
+                    return cached['distance'], cached['cumulative_distance']
+        except Exception as e:
+            print(f"Ignoring unreadable distance cache {cache_path}: {e}")
+
+    distances = consecutive_distances(latitudes, longitudes, method)
+    cumulative_distances = np.nancumsum(distances)
+    cumulative_distances[np.isnan(distances)] = np.nan
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        np.savez(f, distance=distances, cumulative_distance=cumulative_distances)
+    os.replace(temp_path, cache_path)
+    return distances, cumulative_distances
+
+
+# Function to compare the consecutive distances of a tier against geopy on a sample of the pairs and print the
+# error and the speed-up
+def report_distance_error(latitudes, longitudes, method=DEFAULT_DISTANCE_METHOD, sample_size=1000, seed=0):
+    from geopy.distance import geodesic
+
+    latitudes, longitudes = as_float_arrays(latitudes, longitudes)
+    pairs = np.arange(1, len(latitudes))
+    if len(pairs) == 0:
+        return None
+    if len(pairs) > sample_size:
+        pairs = np.sort(np.random.default_rng(seed).choice(pairs, sample_size, replace=False))
+
+    start_time = time.perf_counter()
+    reference = np.array([geodesic((latitudes[i - 1], longitudes[i - 1]), (latitudes[i], longitudes[i])).meters
+                          for i in pairs])
+    reference_elapsed = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    distances = pairwise_distances(latitudes[pairs - 1], longitudes[pairs - 1], latitudes[pairs], longitudes[pairs],
+                                   method)
+    elapsed = time.perf_counter() - start_time
+
+    error = np.abs(distances - reference)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        relative_error = np.where(reference > 0, error / reference, 0.0)
+    report = {
+        "method": method,
+        "pairs": len(pairs),
+        "max_error_m": float(np.nanmax(error)),
+        "mean_error_m": float(np.nanmean(error)),
+        "max_relative_error": float(np.nanmax(relative_error)),
+        "speedup": reference_elapsed / elapsed if elapsed > 0 else float('inf'),
+    }
+    print(f"Distance method {method} on {report['pairs']} pairs: max error {report['max_error_m']:.6f} m "
+          f"(mean {report['mean_error_m']:.6f} m, max relative {report['max_relative_error']:.2e}) against geopy, "
+          f"{report['speedup']:.0f}x faster")
+    return report
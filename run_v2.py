@@ -154,4 +154,5 @@ def process_trajectory(size, type):
 #     for future in futures:
 #         future.result()
 
-process_trajectory(sparse, types)
\ No newline at end of file
+if __name__ == "__main__":
+    process_trajectory(sparse, types)
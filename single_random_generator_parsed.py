@@ -1,166 +1,158 @@
 import os
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from geopy.distance import geodesic
-import geopandas as gpd
-import contextily as ctx
 import random
 import argparse
-
-# Set up argparse
-parser = argparse.ArgumentParser(description="Process AIS trajectories with a specified gap threshold.")
-parser.add_argument("--min_gap_threshold", type=float, default=random.uniform(50000, 200000),
-                    help="Initial minimum gap threshold (default: random between 50,000 and 200,000)")
-parser.add_argument("--input_dir", type=str, required=False,
-                    default="C:/Users/HU84VR/Downloads/AIS Project1/Test Trajectories for AIS 20240831/25 chosen perfect trajectory data",
-                    help="Directory containing input CSV files with AIS trajectories.")
-parser.add_argument("--output_data_dir", type=str, required=False,
-                    default="C:/Users/HU84VR/Downloads/AIS Project1/Test Trajectories for AIS 20240831/data_single",
-                    help="Directory to save output CSV files after processing.")
-parser.add_argument("--output_plots_dir", type=str, required=False,
-                    default="C:/Users/HU84VR/Downloads/AIS Project1/Test Trajectories for AIS 20240831/plots/plots_single",
-                    help="Directory to save output plots.")
-args = parser.parse_args()
-
-# Assign the parsed value to MIN_GAP_THRESHOLD
-MIN_GAP_THRESHOLD = args.min_gap_threshold  # Random float between 50,000 and 200,000'
-input_dir = args.input_dir
-output_data_dir = args.output_data_dir
-output_plots_dir = args.output_plots_dir
-
-# Define directories
-# input_dir = r"C:\Users\HU84VR\Downloads\AIS Project1\Test Trajectories for AIS 20240831\25 chosen perfect trajectory data"
-# output_data_dir = r"C:\Users\HU84VR\Downloads\AIS Project1\Test Trajectories for AIS 20240831\data_single"
-# output_plots_dir = r"C:\Users\HU84VR\Downloads\AIS Project1\Test Trajectories for AIS 20240831\plots\plots_single"
-
-# Verbose output (for debugging or informational purposes)
-print(f"Minimum gap threshold set to: {MIN_GAP_THRESHOLD}")
-print(f"Input directory: {input_dir}")
-print(f"Output data directory: {output_data_dir}")
-print(f"Output plots directory: {output_plots_dir}")
-
-# Create output directories if they don't exist
-os.makedirs(output_data_dir, exist_ok=True)
-os.makedirs(output_plots_dir, exist_ok=True)
-
-# Function to calculate distance between two geographical points using geopy
-def haversine_distance(lat1, lon1, lat2, lon2):
-    point1 = (lat1, lon1)
-    point2 = (lat2, lon2)
-    return geodesic(point1, point2).meters
-
-# Get the geographical extents (min/max lat/lon) across all files
-def get_global_bounds(input_dir):
-    min_lat, max_lat = np.inf, -np.inf
-    min_lon, max_lon = np.inf, -np.inf
-    for filename in os.listdir(input_dir):
+from ais_loader import load_ais_csv, save_ais_csv
+from trajectory_catalog import get_catalog_bounds
+from geo_distance import DISTANCE_METHODS, DEFAULT_DISTANCE_METHOD, cached_consecutive_distances, report_distance_error
+from basemap_cache import load_basemap
+from trajectory_plots import get_plot_job, collect_plot_jobs, render_trajectory_plots
+
+
+# Function to remove one random gap of at least min_gap_threshold meters (halved while the trajectory is shorter)
+# from a trajectory. rng is the random generator to draw from, np.random by default.
+def create_single_gap(data, cumulative_distances, min_gap_threshold, filename, rng=np.random):
+    # Calculate total trajectory length
+    total_length_of_trajectory = data['distance'].sum()
+
+    # Initialize the gap threshold with the standard minimum threshold
+    current_gap_threshold = min_gap_threshold
+
+    # Adjust the minimum gap length if the trajectory is smaller than the gap
+    while total_length_of_trajectory < current_gap_threshold:
+        current_gap_threshold *= 0.5
+        print(f"Adjusting minimum gap threshold to {current_gap_threshold / 1000} km for {filename}")
+
+    # Regenerate start location until enough space for the adjusted gap
+    while True:
+        # Generate random start location
+        single_gap_start_location = rng.uniform(0, 1)
+        remaining_trajectory_length = total_length_of_trajectory * (1 - single_gap_start_location)
+
+        # Check if remaining trajectory can accommodate the adjusted gap
+        if remaining_trajectory_length >= current_gap_threshold:
+            break  # Valid start location, break out of the loop
+
+    # Generate gap length (between the adjusted gap threshold and the remaining trajectory length)
+    single_gap_length = rng.uniform(current_gap_threshold, remaining_trajectory_length)
+
+    # Find the start and end points of the gap based on the percentage of the trajectory
+    cumulative_distance = pd.Series(cumulative_distances, index=data.index)
+    gap_start_distance = single_gap_start_location * total_length_of_trajectory
+    gap_end_distance = gap_start_distance + single_gap_length
+
+    # Remove the rows that fall within the gap
+    return data[(cumulative_distance < gap_start_distance) | (cumulative_distance > gap_end_distance)]
+
+
+def main(argv=None):
+    # Set up argparse
+    parser = argparse.ArgumentParser(description="Process AIS trajectories with a specified gap threshold.")
+    parser.add_argument("--min_gap_threshold", type=float, default=random.uniform(50000, 200000),
+                        help="Initial minimum gap threshold (default: random between 50,000 and 200,000)")
+    parser.add_argument("--input_dir", type=str, required=False,
+                        default="C:/Users/HU84VR/Downloads/AIS Project1/Test Trajectories for AIS 20240831/25 chosen perfect trajectory data",
+                        help="Directory containing input CSV files with AIS trajectories.")
+    parser.add_argument("--output_data_dir", type=str, required=False,
+                        default="C:/Users/HU84VR/Downloads/AIS Project1/Test Trajectories for AIS 20240831/data_single",
+                        help="Directory to save output CSV files after processing.")
+    parser.add_argument("--output_plots_dir", type=str, required=False,
+                        default="C:/Users/HU84VR/Downloads/AIS Project1/Test Trajectories for AIS 20240831/plots/plots_single",
+                        help="Directory to save output plots.")
+    parser.add_argument("--distance_method", choices=DISTANCE_METHODS, default=DEFAULT_DISTANCE_METHOD,
+                        help="Accuracy tier of the distances between consecutive points: exact geodesic (default), "
+                             "vectorized vincenty or spherical haversine.")
+    parser.add_argument("--distance_report", action="store_true",
+                        help="Print the error of the distance method against geopy for each file.")
+    parser.add_argument("--distance_cache_dir", type=str, default=None,
+                        help="Directory of the cached distances of each input file (default: _distance_cache "
+                             "next to the input files).")
+    parser.add_argument("--catalog_dir", type=str, default=None,
+                        help="Directory to keep the catalog of the input directory in (default: next to the input "
+                             "files; a catalog that cannot be written is built in memory).")
+    parser.add_argument("--basemap_cache_dir", type=str, default=None,
+                        help="Directory of the cached basemap tiles and backgrounds (default: ~/.cache/ais_basemaps).")
+    parser.add_argument("--offline", action="store_true",
+                        help="Only use cached basemaps; plots without a cached background are made without it.")
+    parser.add_argument("--plot_workers", type=int, default=1,
+                        help="Number of processes rendering the plots (headless, after all CSV files are saved).")
+    plot_stage = parser.add_mutually_exclusive_group()
+    plot_stage.add_argument("--no-plots", action="store_true",
+                            help="Only save the CSV files; the plots can be made later with --plots-only.")
+    plot_stage.add_argument("--plots-only", action="store_true",
+                            help="Only make the plots, from the CSV files already in the output data directory.")
+    args = parser.parse_args(argv)
+
+    # Assign the parsed value to MIN_GAP_THRESHOLD
+    MIN_GAP_THRESHOLD = args.min_gap_threshold  # Random float between 50,000 and 200,000'
+    input_dir = args.input_dir
+    output_data_dir = args.output_data_dir
+    output_plots_dir = args.output_plots_dir
+    DISTANCE_METHOD = args.distance_method
+
+    # Define directories
+    # input_dir = r"C:\Users\HU84VR\Downloads\AIS Project1\Test Trajectories for AIS 20240831\25 chosen perfect trajectory data"
+    # output_data_dir = r"C:\Users\HU84VR\Downloads\AIS Project1\Test Trajectories for AIS 20240831\data_single"
+    # output_plots_dir = r"C:\Users\HU84VR\Downloads\AIS Project1\Test Trajectories for AIS 20240831\plots\plots_single"
+
+    # Verbose output (for debugging or informational purposes)
+    print(f"Minimum gap threshold set to: {MIN_GAP_THRESHOLD}")
+    print(f"Input directory: {input_dir}")
+    print(f"Output data directory: {output_data_dir}")
+    print(f"Output plots directory: {output_plots_dir}")
+    print(f"Distance method: {DISTANCE_METHOD}")
+
+    # Create output directories if they don't exist
+    os.makedirs(output_data_dir, exist_ok=True)
+    os.makedirs(output_plots_dir, exist_ok=True)
+
+    # Get global bounds for all the data
+    global_min_lat, global_max_lat, global_min_lon, global_max_lon = get_catalog_bounds(input_dir, args.catalog_dir)
+
+    # Process each file in the directory; the plots are rendered afterwards from the saved CSV files
+    plot_jobs = []
+    input_files = [] if args.plots_only else os.listdir(input_dir)
+    for filename in input_files:
         if filename.endswith(".csv"):
-            file_path = os.path.join(input_dir, filename)
-            data = pd.read_csv(file_path)
-            min_lat = min(min_lat, data['Latitude'].min())
-            max_lat = max(max_lat, data['Latitude'].max())
-            min_lon = min(min_lon, data['Longitude'].min())
-            max_lon = max(max_lon, data['Longitude'].max())
-    return min_lat, max_lat, min_lon, max_lon
-
-# Get global bounds for all the data
-global_min_lat, global_max_lat, global_min_lon, global_max_lon = get_global_bounds(input_dir)
-
-# Process each file in the directory
-for filename in os.listdir(input_dir):
-    if filename.endswith(".csv"):
-        try:
-            print(f"Processing file: {filename}")
-
-            # Load the CSV file
-            file_path = os.path.join(input_dir, filename)
-            data = pd.read_csv(file_path)
-
-            # Calculate distances between consecutive points
-            data['distance'] = np.nan
-            for i in range(1, len(data)):
-                lat1, lon1 = data.loc[i-1, 'Latitude'], data.loc[i-1, 'Longitude']
-                lat2, lon2 = data.loc[i, 'Latitude'], data.loc[i, 'Longitude']
-                data.loc[i, 'distance'] = haversine_distance(lat1, lon1, lat2, lon2)
-
-            # Calculate total trajectory length
-            total_length_of_trajectory = data['distance'].sum()
-
-            # Initialize the gap threshold with the standard minimum threshold
-            current_gap_threshold = MIN_GAP_THRESHOLD
-
-            # Adjust the minimum gap length if the trajectory is smaller than the gap
-            while total_length_of_trajectory < current_gap_threshold:
-                current_gap_threshold *= 0.5
-                print(f"Adjusting minimum gap threshold to {current_gap_threshold / 1000} km for {filename}")
-
-            # Regenerate start location until enough space for the adjusted gap
-            while True:
-                # Generate random start location
-                single_gap_start_location = np.random.uniform(0, 1)
-                remaining_trajectory_length = total_length_of_trajectory * (1 - single_gap_start_location)
-
-                # Check if remaining trajectory can accommodate the adjusted gap
-                if remaining_trajectory_length >= current_gap_threshold:
-                    break  # Valid start location, break out of the loop
-
-            # Generate gap length (between the adjusted gap threshold and the remaining trajectory length)
-            single_gap_length = np.random.uniform(current_gap_threshold, remaining_trajectory_length)
-
-            # Find the start and end points of the gap based on the percentage of the trajectory
-            cumulative_distance = data['distance'].cumsum()
-            gap_start_distance = single_gap_start_location * total_length_of_trajectory
-            gap_end_distance = gap_start_distance + single_gap_length
-
-            # Remove the rows that fall within the gap
-            data_with_gap_removed = data[(cumulative_distance < gap_start_distance) | (cumulative_distance > gap_end_distance)]
-
-            # Save the updated dataframe to a new CSV file with "_single_gap" suffix
-            output_file_path = os.path.join(output_data_dir, filename.replace(".csv", "_single_gap.csv"))
-            data_with_gap_removed.to_csv(output_file_path, index=False)
-
-            # Plotting the trajectory
-            fig, ax = plt.subplots(figsize=(10, 10))
-
-            # Convert data to GeoDataFrame for plotting
-            gdf = gpd.GeoDataFrame(
-                data_with_gap_removed,
-                geometry=gpd.points_from_xy(data_with_gap_removed['Longitude'], data_with_gap_removed['Latitude']),
-                crs="EPSG:4326"
-            )
-
-            # Plot the trajectory with smaller markersize
-            gdf.plot(ax=ax, label="Trajectory", color="blue", markersize=5, linewidth=1)
-
-            # Set the x and y limits to the global bounds (fixed map region)
-            ax.set_xlim(global_min_lon, global_max_lon)
-            ax.set_ylim(global_min_lat, global_max_lat)
-
-            # Add map basemap
-            ctx.add_basemap(ax, crs='EPSG:4326', source=ctx.providers.OpenStreetMap.Mapnik)
-
-            # Highlight the start and end points
-            start_point = gdf.iloc[0].geometry
-            end_point = gdf.iloc[-1].geometry
-            ax.scatter([start_point.x], [start_point.y], color="green", s=100, label="Start Point")
-            ax.scatter([end_point.x], [end_point.y], color="red", s=100, label="End Point")
-
-            # Add labels and legend
-            plt.title(f"Trajectory Plot - {filename}")
-            plt.legend()
-
-            # Save the plot
-            plot_file_path = os.path.join(output_plots_dir, filename.replace(".csv", "_trajectory.png"))
-            plt.savefig(plot_file_path)
-
-            # Close the plot to free up memory
-            plt.close()
-
-            print(f"Successfully processed: {filename}")
-# print("Done")
-        except Exception as e:
-            print(f"Error processing file {filename}: {e}")
+            try:
+                print(f"Processing file: {filename}")
+
+                # Load the CSV file
+                file_path = os.path.join(input_dir, filename)
+                data = load_ais_csv(file_path, coordinate_dtype="float64")
+
+                # Calculate distances between consecutive points
+                distances, cumulative_distances = cached_consecutive_distances(
+                    file_path, data['Latitude'], data['Longitude'], DISTANCE_METHOD, args.distance_cache_dir)
+                data['distance'] = distances
+                if args.distance_report:
+                    report_distance_error(data['Latitude'], data['Longitude'], DISTANCE_METHOD)
+
+                # Remove one random gap from the trajectory
+                data_with_gap_removed = create_single_gap(data, cumulative_distances, MIN_GAP_THRESHOLD, filename)
+
+                # Save the updated dataframe to a new CSV file with "_single_gap" suffix
+                output_file_path = os.path.join(output_data_dir, filename.replace(".csv", "_single_gap.csv"))
+                save_ais_csv(data_with_gap_removed, output_file_path)
+
+                plot_jobs.append(get_plot_job(output_file_path, output_plots_dir, filename))
+
+                print(f"Successfully processed: {filename}")
+    # print("Done")
+            except Exception as e:
+                print(f"Error processing file {filename}: {e}")
+
+    if args.plots_only:
+        plot_jobs = collect_plot_jobs(output_data_dir, output_plots_dir, "_single_gap.csv")
+    if not args.no_plots:
+        bounds = (global_min_lon, global_max_lon, global_min_lat, global_max_lat)
+        basemap = load_basemap(bounds, args.basemap_cache_dir, args.offline)
+        render_trajectory_plots(plot_jobs, bounds, basemap, args.plot_workers)
+
+
+if __name__ == "__main__":
+    main()
 
 # run command
 # python
@@ -0,0 +1,79 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# Startup benchmark of the scripts. Every script is imported in a fresh interpreter, as a launch from the command line
+# would, and the import time is reported together with the heavy plotting and geo packages it pulled in. The scripts
+# only load those packages when a function needs them, so importing one to call its functions in-process (or its
+# main(argv)) should cost little more than pandas and numpy.
+
+HEAVY_MODULES = ["geopandas", "contextily", "matplotlib", "geopy", "shapely"]
+
+SCRIPTS = [
+    "ais_loader.py",
+    "geo_distance.py",
+    "gap_intervals.py",
+    "transmission_dropout.py",
+    "trajectory_catalog.py",
+    "trajectory_quality.py",
+    "basemap_cache.py",
+    "trajectory_plots.py",
+    "single_random_generator_parsed.py",
+    "multiple_random_generator_parsed.py",
+    "combined_random_generator_parsed.py",
+    "gap_sweep.py",
+    "MMSI_ship_type_classification.py",
+    "Trajectory_csv_to_GeoJson.py",
+    "trajectory_vector_tiles.py",
+    "csv_trajectories_selection_for_DGVTI.py",
+    "Extract data with 3 missing pattern_2.py",
+]
+
+# Imports one script by its path (some file names are not valid module names) and prints the import time and the
+# heavy modules loaded, as JSON
+IMPORT_PROBE = """
+import sys, json, time, importlib.util
+sys.path.insert(0, sys.argv[1])
+start_time = time.perf_counter()
+spec = importlib.util.spec_from_file_location("probe", sys.argv[2])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+elapsed = time.perf_counter() - start_time
+print(json.dumps({"seconds": elapsed, "loaded": [name for name in sys.argv[3:] if name in sys.modules]}))
+"""
+
+
+# Function to measure the import time (best of repeats, seconds) of a script in fresh interpreters
+def measure_import(script_path, repeats=3):
+    best = None
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, "-c", IMPORT_PROBE, os.path.dirname(script_path), script_path,
+                                 *HEAVY_MODULES], capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "import failed")
+        measurement = json.loads(result.stdout.strip().splitlines()[-1])
+        if best is None or measurement["seconds"] < best["seconds"]:
+            best = measurement
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the import time of every script in a fresh interpreter.")
+    parser.add_argument("--repeats", type=int, default=3, help="Number of imports per script, the best is reported.")
+    parser.add_argument("scripts", nargs="*", default=SCRIPTS, help="Scripts to measure (default: all).")
+    args = parser.parse_args(argv)
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    for script in args.scripts:
+        try:
+            measurement = measure_import(os.path.join(script_dir, script), args.repeats)
+            loaded = ", ".join(measurement["loaded"]) or "-"
+            print(f"{script:45s} {measurement['seconds']:7.3f} s   heavy modules: {loaded}")
+        except Exception as e:
+            print(f"Error processing file {script}: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from MMSI_ship_type_classification import process_all_files_in_directory
+from Trajectory_csv_to_GeoJson import process_directory
+from trajectory_catalog import load_catalog
+from trajectory_quality import QUALITY_FILENAME, QUALITY_SEPARATOR
+import csv_trajectories_selection_for_DGVTI as selection
+
+DAY = "aisdk-2024-08-31"
+
+
+# One daily aisdk file with a cargo ship inside the Skagen selection box and a tanker outside of it
+def write_daily_file(input_dir, extra_rows=()):
+    rows = []
+    for mmsi, ship_type, latitude, longitude in ((219000001, "Cargo", 57.2, 10.5), (219000002, "Tanker", 55.0, 12.5)):
+        for minute in range(5):
+            rows.append({"# Timestamp": f"31/08/2024 00:{minute:02d}:00", "Type of mobile": "Class A", "MMSI": mmsi,
+                         "Latitude": latitude + minute * 0.001, "Longitude": longitude + minute * 0.001,
+                         "Navigational status": "Under way using engine", "SOG": 10.0, "COG": 45.0,
+                         "Heading": 45.0, "Draught": 7.5, "Ship type": ship_type})
+    rows.extend(extra_rows)
+    pd.DataFrame(rows).to_csv(os.path.join(input_dir, f"{DAY}.csv"), index=False)
+
+
+@pytest.fixture
+def classified_dir(tmp_path):
+    input_dir = tmp_path / "input"
+    output_dir = tmp_path / "classified"
+    input_dir.mkdir()
+    write_daily_file(input_dir)
+    process_all_files_in_directory(str(input_dir), str(output_dir))
+    return output_dir
+
+
+def list_csv_files(directory):
+    return sorted(os.path.relpath(os.path.join(root, name), directory)
+                  for root, _, names in os.walk(directory) for name in names if name.endswith(".csv"))
+
+
+def test_classified_tree_only_holds_trajectory_csv_files(classified_dir):
+    assert list_csv_files(classified_dir) == [
+        os.path.join(DAY, "Cargo", f"{DAY}_MMSI_219000001.csv"),
+        os.path.join(DAY, "Tanker", f"{DAY}_MMSI_219000002.csv"),
+    ]
+
+
+def test_geojson_conversion_of_classified_tree(classified_dir, tmp_path, capsys):
+    geojson_dir = tmp_path / "geojson"
+    process_directory(str(classified_dir), str(geojson_dir))
+
+    assert "Error processing file" not in capsys.readouterr().out
+    outputs = sorted(os.path.relpath(os.path.join(root, name), geojson_dir)
+                     for root, _, names in os.walk(geojson_dir) for name in names if not name.startswith("_"))
+    assert outputs == [
+        os.path.join(DAY, "Cargo", f"{DAY}_MMSI_219000001.geojson"),
+        os.path.join(DAY, "Tanker", f"{DAY}_MMSI_219000002.geojson"),
+    ]
+
+
+def test_selection_of_classified_day(classified_dir, tmp_path, capsys):
+    day_dir = classified_dir / DAY
+    assert load_catalog(str(day_dir)).empty
+    assert len(load_catalog(str(day_dir / "Cargo"))) == 1
+
+    selected_dir = tmp_path / "selected"
+    for ship_type in ("Cargo", "Tanker"):
+        selection.select_trajectories(str(day_dir / ship_type), str(selected_dir))
+
+    assert "Error processing file" not in capsys.readouterr().out
+    assert sorted(os.listdir(selected_dir)) == [f"{DAY}_MMSI_219000001.csv"]
+
+
+def test_streaming_skips_rows_without_mmsi(tmp_path):
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    write_daily_file(input_dir, [{"# Timestamp": "31/08/2024 00:10:00", "Type of mobile": "Class A", "MMSI": None,
+                                  "Latitude": 56.0, "Longitude": 11.0, "Ship type": "Cargo"}])
+
+    process_all_files_in_directory(str(input_dir), str(tmp_path / "loaded"))
+    process_all_files_in_directory(str(input_dir), str(tmp_path / "streamed"), stream=True)
+
+    assert list_csv_files(tmp_path / "streamed") == list_csv_files(tmp_path / "loaded")
+    assert len(list_csv_files(tmp_path / "streamed")) == 2
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_failed_file_does_not_stop_the_run(tmp_path, capsys, workers):
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    write_daily_file(input_dir)
+    pd.DataFrame({"MMSI": [219000003]}).to_csv(input_dir / "aisdk-2024-09-01.csv", index=False)
+
+    output_dir = tmp_path / "classified"
+    process_all_files_in_directory(str(input_dir), str(output_dir), workers=workers)
+
+    assert "Failed files:" in capsys.readouterr().out
+    assert len(list_csv_files(output_dir)) == 2
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_parquet_output_keeps_the_quality_tables(tmp_path, stream):
+    pytest.importorskip("pyarrow")
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    write_daily_file(input_dir)
+
+    output_dir = tmp_path / "dataset"
+    process_all_files_in_directory(str(input_dir), str(output_dir), stream=stream, output_format="parquet")
+
+    assert os.path.isfile(output_dir / f"day={DAY}" / QUALITY_FILENAME)
+    summary = pd.read_csv(output_dir / QUALITY_FILENAME, sep=QUALITY_SEPARATOR)
+    assert sorted(summary['MMSI']) == [219000001, 219000002]
+
+
+def test_selection_command_line(classified_dir, tmp_path):
+    selected_dir = tmp_path / "selected"
+    selection.main(["--input_dir", str(classified_dir / DAY / "Cargo"), "--output_dir", str(selected_dir)])
+    assert os.listdir(selected_dir) == [f"{DAY}_MMSI_219000001.csv"]
@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gap_sweep import SWEEP_MANIFEST_FILENAME, run_sweep
+
+
+# Function to write a trajectory of 200 points over about 200 km northwards
+def write_trajectory(path):
+    pd.DataFrame({"# Timestamp": pd.date_range("2024-08-31", periods=200, freq="min").strftime("%d/%m/%Y %H:%M:%S"),
+                  "MMSI": 219000001, "Latitude": [round(55.0 + point * 0.009, 3) for point in range(200)],
+                  "Longitude": 10.5, "SOG": 10.0}).to_csv(path, index=False)
+
+
+def test_sweep_manifest_and_scenario_files(tmp_path):
+    input_dir = tmp_path / "trajectories"
+    input_dir.mkdir()
+    write_trajectory(input_dir / "trajectory.csv")
+
+    output_dir = tmp_path / "sweep"
+    values = {"num_gaps": [2], "min_gap_threshold": [20000.0]}
+    run_sweep(str(input_dir), str(output_dir), ["multiple"], values, replicates=2)
+
+    # The parameters of the manifest are written as in the scenario directories
+    with open(output_dir / SWEEP_MANIFEST_FILENAME) as f:
+        rows = f.read().splitlines()[1:]
+    assert len(rows) == 2
+    assert all(row.startswith("multiple,2,20000,") for row in rows)
+    manifest = pd.read_csv(output_dir / SWEEP_MANIFEST_FILENAME)
+    assert all(name.startswith("multiple/num_gaps=2_min_gap_threshold=20000/") for name in manifest['output_file'])
+
+    # Every scenario file holds a subset of the input rows, in order, with the distance column added
+    with open(input_dir / "trajectory.csv") as f:
+        input_lines = f.read().splitlines()
+    for output_file in manifest['output_file']:
+        with open(output_dir / output_file) as f:
+            lines = [line.rsplit(",", 1)[0] for line in f.read().splitlines()]
+        assert lines[0] == input_lines[0]
+        assert 1 < len(lines) < len(input_lines)
+        assert [input_lines.index(line) for line in lines] == sorted(input_lines.index(line) for line in lines)
@@ -0,0 +1,60 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import trajectory_catalog
+from trajectory_catalog import get_catalog_path, load_catalog, query_catalog_bbox
+
+
+# Function to write a short trajectory along the given latitude and longitude
+def write_trajectory(path, latitude, longitude):
+    pd.DataFrame({"# Timestamp": [f"31/08/2024 00:0{minute}:00" for minute in range(3)], "MMSI": 219000001,
+                  "Latitude": [latitude + minute * 0.001 for minute in range(3)],
+                  "Longitude": [longitude + minute * 0.001 for minute in range(3)]}).to_csv(path, index=False)
+
+
+@pytest.fixture
+def trajectory_dir(tmp_path):
+    input_dir = tmp_path / "trajectories"
+    input_dir.mkdir()
+    write_trajectory(input_dir / "inside.csv", 57.2, 10.5)
+    write_trajectory(input_dir / "outside.csv", 55.0, 12.5)
+    return input_dir
+
+
+def test_catalog_dir_keeps_the_input_directory_untouched(trajectory_dir, tmp_path):
+    catalog_dir = tmp_path / "catalogs"
+    assert len(load_catalog(str(trajectory_dir), catalog_dir=str(catalog_dir))) == 2
+
+    assert sorted(os.listdir(trajectory_dir)) == ["inside.csv", "outside.csv"]
+    assert os.path.exists(get_catalog_path(str(trajectory_dir), str(catalog_dir)))
+
+
+def test_read_only_directory_is_scanned_in_memory(trajectory_dir, monkeypatch, capsys):
+    # Also runs as root, which could write to a directory without write permission
+    monkeypatch.setattr(trajectory_catalog.os, "access", lambda path, mode: False)
+    catalog = query_catalog_bbox(str(trajectory_dir), 10.0, 57.0, 11.0, 58.0)
+
+    assert list(catalog['file']) == ["inside.csv"]
+    assert "in memory" in capsys.readouterr().out
+    assert sorted(os.listdir(trajectory_dir)) == ["inside.csv", "outside.csv"]
+
+
+def test_failed_files_are_recorded_and_always_candidates(trajectory_dir):
+    (trajectory_dir / "broken.csv").write_text("MMSI,Latitude\n219000001,not a number\n")
+
+    catalog = load_catalog(str(trajectory_dir))
+    assert catalog.set_index('file')['error'].notna().to_dict() == {
+        "broken.csv": True, "inside.csv": False, "outside.csv": False}
+
+    candidates = query_catalog_bbox(str(trajectory_dir), 10.0, 57.0, 11.0, 58.0)
+    assert sorted(candidates['file']) == ["broken.csv", "inside.csv"]
+    assert not candidates.set_index('file').loc["broken.csv", 'within']
+
+    # Once fixed, the file is scanned again and falls outside the box
+    write_trajectory(trajectory_dir / "broken.csv", 55.0, 12.5)
+    assert list(query_catalog_bbox(str(trajectory_dir), 10.0, 57.0, 11.0, 58.0)['file']) == ["inside.csv"]
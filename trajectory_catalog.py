@@ -0,0 +1,207 @@
+import os
+import time
+import hashlib
+import sqlite3
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from ais_loader import TIMESTAMP_COLUMN, load_ais_csv
+
+# Per-file catalog of the trajectory CSV files in a directory: extent, time range, row count, MMSI and ship type.
+# It lives next to the files in a small SQLite database and is refreshed from the file size and modification
+# time, so only new or changed files are read again. Selection and global-bounds queries then run against the
+# catalog instead of reading every CSV.
+# The catalog can be kept in a separate catalog directory instead, e.g. for read-only or shared datasets; when the
+# catalog cannot be written at all, the files are scanned into an in-memory catalog for the current query. Files that
+# fail to scan are recorded with their error, scanned again on the next query and returned as candidates of every
+# selection, so they are never silently left out.
+
+CATALOG_FILENAME = "_trajectory_catalog.sqlite"
+CATALOG_COLUMNS = ['file', 'size', 'mtime_ns', 'MMSI', 'ship_type', 'points', 'min_lat', 'max_lat',
+                   'min_lon', 'max_lon', 'first_timestamp', 'last_timestamp', 'error']
+CATALOG_READ_COLUMNS = [TIMESTAMP_COLUMN, 'MMSI', 'Ship type', 'Latitude', 'Longitude']
+
+
+# Function to get the catalog file of a directory: next to the files, or in catalog_dir under a name derived from
+# the directory path so one catalog directory can hold the catalogs of many directories
+def get_catalog_path(input_dir, catalog_dir=None):
+    if catalog_dir is None:
+        return os.path.join(input_dir, CATALOG_FILENAME)
+    input_dir = os.path.abspath(input_dir)
+    key = hashlib.sha256(input_dir.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(catalog_dir, f"{os.path.basename(input_dir)}_{key}{CATALOG_FILENAME}")
+
+
+def create_catalog_table(connection):
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(trajectories)")]
+    if columns and columns != CATALOG_COLUMNS:
+        connection.execute("DROP TABLE trajectories")  # Catalog of an older layout, rebuilt from the files
+    connection.execute("CREATE TABLE IF NOT EXISTS trajectories (file TEXT PRIMARY KEY, size INTEGER, "
+                       "mtime_ns INTEGER, MMSI INTEGER, ship_type TEXT, points INTEGER, min_lat REAL, "
+                       "max_lat REAL, min_lon REAL, max_lon REAL, first_timestamp TEXT, last_timestamp TEXT, "
+                       "error TEXT)")
+
+
+# Function to open the catalog of a directory, or an empty in-memory catalog when it cannot be written
+def open_catalog(input_dir, catalog_dir=None):
+    catalog_path = get_catalog_path(input_dir, catalog_dir)
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(catalog_path)), exist_ok=True)
+        if not os.access(os.path.dirname(os.path.abspath(catalog_path)), os.W_OK):
+            raise PermissionError(f"{os.path.dirname(os.path.abspath(catalog_path))} is not writable")
+        connection = sqlite3.connect(catalog_path)
+        create_catalog_table(connection)
+        connection.commit()
+        return connection
+    except (OSError, sqlite3.Error) as e:
+        print(f"Cannot write the catalog {catalog_path} ({e}), scanning {input_dir} in memory")
+        connection = sqlite3.connect(":memory:")
+        create_catalog_table(connection)
+        return connection
+
+
+# Function to read the catalog entry of one trajectory file
+def scan_trajectory_file(input_dir, file_name):
+    file_path = os.path.join(input_dir, file_name)
+    stat = os.stat(file_path)
+    data = load_ais_csv(file_path, columns=CATALOG_READ_COLUMNS, coordinate_dtype="float64")
+
+    entry = {'file': file_name, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'MMSI': None,
+             'ship_type': None, 'points': len(data), 'min_lat': None, 'max_lat': None, 'min_lon': None,
+             'max_lon': None, 'first_timestamp': None, 'last_timestamp': None, 'error': None}
+    if len(data) == 0:
+        return entry
+
+    if 'MMSI' in data.columns:
+        entry['MMSI'] = int(data['MMSI'].iloc[0])  # Assume MMSI is consistent
+    if 'Ship type' in data.columns:
+        entry['ship_type'] = str(data['Ship type'].iloc[0])
+    for column, name in (('Latitude', 'lat'), ('Longitude', 'lon')):
+        if column in data.columns and data[column].notna().any():
+            entry[f'min_{name}'] = float(data[column].min())
+            entry[f'max_{name}'] = float(data[column].max())
+    if TIMESTAMP_COLUMN in data.columns and data[TIMESTAMP_COLUMN].notna().any():
+        entry['first_timestamp'] = data[TIMESTAMP_COLUMN].min().isoformat(sep=' ')
+        entry['last_timestamp'] = data[TIMESTAMP_COLUMN].max().isoformat(sep=' ')
+    return entry
+
+
+# Function to get the catalog entry of a file that failed to scan. It has no size or modification time, so it is
+# scanned again on the next update.
+def get_failed_entry(file_name, error):
+    entry = {column: None for column in CATALOG_COLUMNS}
+    entry.update({'file': file_name, 'error': str(error)})
+    return entry
+
+
+# Function to bring the catalog of a directory up to date and return the open catalog: new, changed and failed
+# files are scanned, entries of removed files are dropped
+def open_updated_catalog(input_dir, workers=1, catalog_dir=None):
+    start_time = time.perf_counter()
+    files = {}
+    for file_name in os.listdir(input_dir):
+        if file_name.endswith('.csv'):
+            stat = os.stat(os.path.join(input_dir, file_name))
+            files[file_name] = (stat.st_size, stat.st_mtime_ns)
+
+    connection = open_catalog(input_dir, catalog_dir)
+    known = {file_name: (size, mtime_ns) for file_name, size, mtime_ns in
+             connection.execute("SELECT file, size, mtime_ns FROM trajectories")}
+    removed = [file_name for file_name in known if file_name not in files]
+    changed = sorted(file_name for file_name, signature in files.items() if known.get(file_name) != signature)
+
+    entries = []
+    if workers > 1 and len(changed) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(scan_trajectory_file, input_dir, file_name): file_name
+                       for file_name in changed}
+            for future in as_completed(futures):
+                try:
+                    entries.append(future.result())
+                except Exception as e:
+                    print(f"Error processing file {futures[future]}: {e}")
+                    entries.append(get_failed_entry(futures[future], e))
+    else:
+        for file_name in changed:
+            try:
+                entries.append(scan_trajectory_file(input_dir, file_name))
+            except Exception as e:
+                print(f"Error processing file {file_name}: {e}")
+                entries.append(get_failed_entry(file_name, e))
+
+    placeholders = ", ".join("?" for _ in CATALOG_COLUMNS)
+    connection.executemany("DELETE FROM trajectories WHERE file = ?", [(file_name,) for file_name in removed])
+    connection.executemany(f"INSERT OR REPLACE INTO trajectories VALUES ({placeholders})",
+                           [tuple(entry[column] for column in CATALOG_COLUMNS) for entry in entries])
+    connection.commit()
+
+    if entries or removed:
+        elapsed = time.perf_counter() - start_time
+        print(f"Catalog of {input_dir}: scanned {len(entries)} files, removed {len(removed)}, "
+              f"{len(files) - len(changed)} unchanged ({elapsed:.2f} s)")
+    return connection
+
+
+# Function to bring the catalog of a directory up to date
+def update_catalog(input_dir, workers=1, catalog_dir=None):
+    open_updated_catalog(input_dir, workers, catalog_dir).close()
+
+
+# Function to load the up-to-date catalog of a directory as a DataFrame
+def load_catalog(input_dir, workers=1, catalog_dir=None):
+    connection = open_updated_catalog(input_dir, workers, catalog_dir)
+    catalog = pd.read_sql_query("SELECT * FROM trajectories ORDER BY file", connection)
+    connection.close()
+    return catalog
+
+
+# Function to get the geographical extents (min/max lat/lon) across all files of a directory from its catalog
+def get_catalog_bounds(input_dir, catalog_dir=None):
+    connection = open_updated_catalog(input_dir, catalog_dir=catalog_dir)
+    bounds = connection.execute("SELECT MIN(min_lat), MAX(max_lat), MIN(min_lon), MAX(max_lon) "
+                                "FROM trajectories").fetchone()
+    connection.close()
+    min_lat, max_lat, min_lon, max_lon = (np.nan if value is None else value for value in bounds)
+    if np.isnan(min_lat):
+        return np.inf, -np.inf, np.inf, -np.inf
+    return min_lat, max_lat, min_lon, max_lon
+
+
+# Function to find the files whose extent intersects a bounding box. The 'within' column tells whether the whole
+# extent lies strictly inside the box, in which case every point of the file is inside it too. Files that failed
+# to scan are always candidates, never within.
+def query_catalog_bbox(input_dir, min_lon, min_lat, max_lon, max_lat, catalog_dir=None):
+    connection = open_updated_catalog(input_dir, catalog_dir=catalog_dir)
+    candidates = pd.read_sql_query(
+        "SELECT *, (error IS NULL AND min_lon > ? AND max_lon < ? AND min_lat > ? AND max_lat < ?) AS within "
+        "FROM trajectories WHERE error IS NOT NULL "
+        "OR (min_lon <= ? AND max_lon >= ? AND min_lat <= ? AND max_lat >= ?) ORDER BY file", connection,
+        params=(min_lon, max_lon, min_lat, max_lat, max_lon, min_lon, max_lat, min_lat))
+    connection.close()
+    candidates['within'] = candidates['within'].astype(bool)
+    return candidates
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or refresh the catalog of a directory of trajectory CSV files.")
+    parser.add_argument("input_dir", type=str, help="Directory containing trajectory CSV files.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes used to scan changed files.")
+    parser.add_argument("--catalog_dir", type=str, default=None,
+                        help="Directory to keep the catalog in (default: next to the files).")
+    args = parser.parse_args(argv)
+
+    catalog = load_catalog(args.input_dir, args.workers, args.catalog_dir)
+    print(f"{len(catalog)} trajectories, {int(catalog['points'].sum())} points in "
+          f"{get_catalog_path(args.input_dir, args.catalog_dir)}")
+    failed = catalog.loc[catalog['error'].notna(), 'file']
+    if not failed.empty:
+        print(f"Failed files: {', '.join(failed)}")
+    if not catalog.empty:
+        print(f"Extent: lat {catalog['min_lat'].min()} to {catalog['max_lat'].max()}, "
+              f"lon {catalog['min_lon'].min()} to {catalog['max_lon'].max()}")
+        print(f"Time range: {catalog['first_timestamp'].min()} to {catalog['last_timestamp'].max()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from ais_loader import load_ais_csv
+from basemap_cache import draw_basemap
+
+# Plot stage of the gap generators. The trajectories with gaps are plotted from the saved CSV files, headless on
+# the Agg backend and optionally on a pool of processes, so generating scenarios never waits for plotting and the
+# plots can be made later from the CSV files alone. A plot job is (csv_path, plot_file_path, title).
+
+# Background of the running worker, set once by init_plot_worker instead of being sent with every job
+worker_basemap = None
+
+
+def init_plot_worker(basemap=None):
+    global worker_basemap
+    import matplotlib
+    matplotlib.use("Agg")
+    worker_basemap = basemap
+
+
+# Function to build the plot job of the output CSV file of an input file
+def get_plot_job(output_file_path, output_plots_dir, filename):
+    plot_file_path = os.path.join(output_plots_dir, filename.replace(".csv", "_trajectory.png"))
+    return output_file_path, plot_file_path, f"Trajectory Plot - {filename}"
+
+
+# Function to build the plot jobs of all output CSV files (ending with suffix) already in output_data_dir
+def collect_plot_jobs(output_data_dir, output_plots_dir, suffix):
+    jobs = []
+    for output_name in sorted(os.listdir(output_data_dir)):
+        if output_name.endswith(suffix):
+            filename = output_name[:-len(suffix)] + ".csv"
+            jobs.append(get_plot_job(os.path.join(output_data_dir, output_name), output_plots_dir, filename))
+    return jobs
+
+
+# Function to plot a trajectory with its start (green) and end (red) point over the shared extent
+# bounds = (min_lon, max_lon, min_lat, max_lat)
+def plot_trajectory(csv_path, plot_file_path, title, bounds, basemap=None):
+    import matplotlib.pyplot as plt
+    import geopandas as gpd
+
+    data = load_ais_csv(csv_path, columns=['Latitude', 'Longitude'], parse_timestamps=False)
+    fig, ax = plt.subplots(figsize=(10, 10))
+
+    # Convert data to GeoDataFrame for plotting
+    gdf = gpd.GeoDataFrame(data, geometry=gpd.points_from_xy(data['Longitude'], data['Latitude']), crs="EPSG:4326")
+
+    # Plot the trajectory with smaller markersize
+    gdf.plot(ax=ax, label="Trajectory", color="blue", markersize=5, linewidth=1)
+
+    # Set the x and y limits to the global bounds (fixed map region)
+    ax.set_xlim(bounds[0], bounds[1])
+    ax.set_ylim(bounds[2], bounds[3])
+
+    # Add map basemap
+    draw_basemap(ax, basemap)
+
+    # Highlight the start and end points
+    start_point = gdf.iloc[0].geometry
+    end_point = gdf.iloc[-1].geometry
+    ax.scatter([start_point.x], [start_point.y], color="green", s=100, label="Start Point")
+    ax.scatter([end_point.x], [end_point.y], color="red", s=100, label="End Point")
+
+    # Add labels and legend
+    plt.title(title)
+    plt.legend()
+
+    # Save the plot and close it to free up memory
+    plt.savefig(plot_file_path)
+    plt.close(fig)
+
+
+def render_plot_job(csv_path, plot_file_path, title, bounds):
+    plot_trajectory(csv_path, plot_file_path, title, bounds, worker_basemap)
+
+
+# Function to render all plot jobs, in a pool of workers processes when workers > 1
+def render_trajectory_plots(jobs, bounds, basemap=None, workers=1):
+    start_time = time.perf_counter()
+    rendered = 0
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_plot_worker,
+                                 initargs=(basemap,)) as executor:
+            futures = {executor.submit(render_plot_job, *job, bounds): job for job in jobs}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    rendered += 1
+                except Exception as e:
+                    print(f"Error plotting file {os.path.basename(futures[future][0])}: {e}")
+    else:
+        init_plot_worker(basemap)
+        for job in jobs:
+            try:
+                render_plot_job(*job, bounds)
+                rendered += 1
+            except Exception as e:
+                print(f"Error plotting file {os.path.basename(job[0])}: {e}")
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Rendered {rendered} of {len(jobs)} plots in {elapsed:.2f} s")
+    return rendered
@@ -0,0 +1,122 @@
+import os
+import pandas as pd
+from ais_loader import TIMESTAMP_COLUMN, parse_ais_timestamps
+from geo_distance import haversine_meters
+
+# Per-MMSI quality statistics used to pick "perfect" trajectories: no missing longitude/latitude/draught and no
+# long positional gaps. They are computed while the daily files are classified, chunk by chunk, so the
+# per-MMSI CSV files never have to be read a second time. The tables are tab-separated and not named *.csv, since
+# they live in the classified tree where every *.csv file is taken for a trajectory.
+
+QUALITY_FILENAME = "_trajectory_quality.tsv"
+QUALITY_SEPARATOR = "\t"
+QUALITY_NAN_COLUMNS = ['Latitude', 'Longitude', 'Draught', 'SOG', 'COG', 'Heading']
+
+
+# Function to compute the partial statistics of one chunk. last_points holds the last valid position of every
+# MMSI seen in earlier chunks so the gap and distance across the chunk boundary are counted too.
+def compute_quality_partials(data, last_points=None):
+    mmsi = data['MMSI']
+    timestamps = parse_ais_timestamps(data[TIMESTAMP_COLUMN])
+
+    # Count the missing values per MMSI
+    nan_columns = [column for column in QUALITY_NAN_COLUMNS if column in data.columns]
+    missing = pd.DataFrame({f"nan_{column}": pd.to_numeric(data[column], errors='coerce').isna()
+                            for column in nan_columns}, index=data.index)
+    missing['MMSI'] = mmsi
+    grouped = missing.groupby('MMSI', sort=False)
+    partials = grouped.sum()
+    partials['points'] = grouped.size()
+
+    # The ship type of an MMSI is the one of its first row, as in the classified outputs
+    first_rows = ~mmsi.duplicated()
+    partials['ship_type'] = pd.Series(data.loc[first_rows, 'Ship type'].astype(str).values,
+                                      index=mmsi[first_rows].values)
+
+    # Time gaps and distance are measured between the valid positions of each MMSI in time order
+    positions = pd.DataFrame({
+        'MMSI': mmsi,
+        'time': timestamps,
+        'Latitude': pd.to_numeric(data['Latitude'], errors='coerce'),
+        'Longitude': pd.to_numeric(data['Longitude'], errors='coerce'),
+        'carried': False,
+    })
+    positions = positions.dropna(subset=['time', 'Latitude', 'Longitude'])
+    if last_points is not None and not last_points.empty:
+        carried = last_points.loc[last_points.index.isin(positions['MMSI'])].reset_index()
+        carried['carried'] = True
+        positions = pd.concat([carried, positions], ignore_index=True)
+    positions = positions.sort_values(['MMSI', 'time'], kind='stable')
+
+    same_mmsi = positions['MMSI'].eq(positions['MMSI'].shift())
+    gaps = positions['time'].diff().dt.total_seconds().where(same_mmsi)
+    distances = pd.Series(haversine_meters(positions['Latitude'].shift(), positions['Longitude'].shift(),
+                                           positions['Latitude'], positions['Longitude']),
+                          index=positions.index).where(same_mmsi)
+
+    own_positions = positions.loc[~positions['carried']]
+    partials['max_gap_s'] = gaps.groupby(positions['MMSI']).max()
+    partials['distance_m'] = distances.groupby(positions['MMSI']).sum()
+    partials['first_timestamp'] = own_positions.groupby('MMSI')['time'].min()
+    partials['last_timestamp'] = own_positions.groupby('MMSI')['time'].max()
+
+    # Remember the latest position of every MMSI for the next chunk
+    new_last_points = positions.groupby('MMSI').tail(1).set_index('MMSI')[['time', 'Latitude', 'Longitude']]
+    if last_points is not None and not last_points.empty:
+        new_last_points = pd.concat([last_points.loc[~last_points.index.isin(new_last_points.index)],
+                                     new_last_points])
+
+    return partials, new_last_points
+
+
+# Function to combine the partial statistics of several chunks and turn the counts into ratios
+def finalize_quality(partials_list, day):
+    partials = pd.concat(partials_list)
+    nan_count_columns = [column for column in partials.columns if column.startswith("nan_")]
+    aggregations = {column: 'sum' for column in nan_count_columns + ['points', 'distance_m']}
+    aggregations.update({'ship_type': 'first', 'max_gap_s': 'max',
+                         'first_timestamp': 'min', 'last_timestamp': 'max'})
+    quality = partials.groupby(level=0, sort=False).agg(aggregations)
+
+    for column in nan_count_columns:
+        quality[f"nan_ratio_{column[len('nan_'):]}"] = quality.pop(column) / quality['points']
+    quality.index.name = 'MMSI'
+    quality = quality.reset_index()
+    quality.insert(0, 'day', day)
+
+    leading_columns = ['day', 'MMSI', 'ship_type', 'points', 'first_timestamp', 'last_timestamp',
+                       'max_gap_s', 'distance_m']
+    return quality[leading_columns + [column for column in quality.columns if column not in leading_columns]]
+
+
+def save_quality(quality, day_directory):
+    os.makedirs(day_directory, exist_ok=True)
+    quality.to_csv(os.path.join(day_directory, QUALITY_FILENAME), sep=QUALITY_SEPARATOR, index=False)
+
+
+# Function to gather the per-day quality tables below an output directory into one summary table
+def merge_quality_tables(output_directory):
+    day_tables = []
+    for name in sorted(os.listdir(output_directory)):
+        table_path = os.path.join(output_directory, name, QUALITY_FILENAME)
+        if os.path.isfile(table_path):
+            day_tables.append(pd.read_csv(table_path, sep=QUALITY_SEPARATOR))
+    if not day_tables:
+        return None
+
+    summary = pd.concat(day_tables, ignore_index=True).drop_duplicates(['day', 'MMSI'], keep='last')
+    summary_path = os.path.join(output_directory, QUALITY_FILENAME)
+    temp_path = f"{summary_path}.tmp"
+    summary.to_csv(temp_path, sep=QUALITY_SEPARATOR, index=False)
+    os.replace(temp_path, summary_path)
+    print(f"Trajectory quality summary of {len(summary)} trajectories saved to: {summary_path}")
+    return summary
+
+
+# Function to select the "perfect" trajectories from the summary table
+def filter_perfect_trajectories(quality, max_gap_s=600, min_points=2,
+                                complete_columns=('Latitude', 'Longitude', 'Draught')):
+    selected = (quality['max_gap_s'] <= max_gap_s) & (quality['points'] >= min_points)
+    for column in complete_columns:
+        selected &= quality[f"nan_ratio_{column}"] == 0
+    return quality.loc[selected]
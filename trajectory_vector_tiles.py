@@ -0,0 +1,184 @@
+import os
+import json
+import gzip
+import time
+import sqlite3
+import argparse
+import numpy as np
+from Trajectory_csv_to_GeoJson import collect_trajectory_layers
+
+# Level-of-detail export of the trajectories as a Mapbox vector tile pyramid, either one offline MBTiles
+# file or a z/x/y.pbf directory. Every zoom level gets its own copy of the lines simplified with
+# Douglas-Peucker at a tolerance of about one screen pixel, so low zooms stay small and fast to draw.
+
+TILE_SIZE_PX = 256
+TILE_EXTENT = 4096
+TILE_BUFFER = 64  # in tile extent units, so lines do not end exactly on the tile edge
+WEB_MERCATOR_HALF_WORLD = 20037508.342789244
+TILE_LAYER_NAME = "trajectories"
+
+
+# Function to get the width of one tile (meters, EPSG:3857) at a zoom level
+def tile_size_meters(zoom):
+    return 2 * WEB_MERCATOR_HALF_WORLD / 2 ** zoom
+
+
+# Function to get the simplification tolerance (meters) of a zoom level
+def zoom_tolerance(zoom, tolerance_px=1.0):
+    return tile_size_meters(zoom) / TILE_SIZE_PX * tolerance_px
+
+
+# Function to get the EPSG:3857 bounds of a tile in XYZ numbering
+def tile_bounds(zoom, x, y):
+    size = tile_size_meters(zoom)
+    min_x = -WEB_MERCATOR_HALF_WORLD + x * size
+    max_y = WEB_MERCATOR_HALF_WORLD - y * size
+    return (min_x, max_y - size, min_x + size, max_y)
+
+
+# Function to get the tile columns and rows covered by EPSG:3857 bounds
+def tile_ranges(bounds, zoom):
+    size = tile_size_meters(zoom)
+    last = 2 ** zoom - 1
+    x0 = np.clip(np.floor((bounds[:, 0] + WEB_MERCATOR_HALF_WORLD) / size), 0, last).astype(np.int64)
+    x1 = np.clip(np.floor((bounds[:, 2] + WEB_MERCATOR_HALF_WORLD) / size), 0, last).astype(np.int64)
+    y0 = np.clip(np.floor((WEB_MERCATOR_HALF_WORLD - bounds[:, 3]) / size), 0, last).astype(np.int64)
+    y1 = np.clip(np.floor((WEB_MERCATOR_HALF_WORLD - bounds[:, 1]) / size), 0, last).astype(np.int64)
+    return x0, x1, y0, y1
+
+
+# Function to build the encoded tiles of one zoom level, yields (x, y, tile_data)
+def build_zoom_tiles(geometries, mmsis, zoom, tolerance_px=1.0):
+    import shapely
+    import mapbox_vector_tile
+
+    # Simplify all lines of this zoom level in one vectorized call
+    simplified = shapely.simplify(geometries, zoom_tolerance(zoom, tolerance_px), preserve_topology=False)
+    x0, x1, y0, y1 = tile_ranges(shapely.bounds(simplified), zoom)
+
+    # Group the lines by the tiles their bounding box touches
+    tile_members = {}
+    for i in range(len(simplified)):
+        for x in range(x0[i], x1[i] + 1):
+            for y in range(y0[i], y1[i] + 1):
+                tile_members.setdefault((int(x), int(y)), []).append(i)
+
+    buffer = tile_size_meters(zoom) * TILE_BUFFER / TILE_EXTENT
+    for (x, y), members in sorted(tile_members.items()):
+        bounds = tile_bounds(zoom, x, y)
+        clipped = shapely.clip_by_rect(simplified[members], bounds[0] - buffer, bounds[1] - buffer,
+                                       bounds[2] + buffer, bounds[3] + buffer)
+        features = [{"geometry": geometry, "properties": {"MMSI": int(mmsis[i])}}
+                    for geometry, i in zip(clipped, members) if not geometry.is_empty]
+        if not features:
+            continue
+        tile_data = mapbox_vector_tile.encode(
+            [{"name": TILE_LAYER_NAME, "features": features}],
+            default_options={"quantize_bounds": bounds, "extents": TILE_EXTENT})
+        yield x, y, tile_data
+
+
+# Function to build the tile metadata shared by both output formats
+def build_tile_metadata(lines, min_zoom, max_zoom, name):
+    min_lon, min_lat, max_lon, max_lat = lines.total_bounds
+    return {
+        "name": name,
+        "format": "pbf",
+        "type": "overlay",
+        "minzoom": str(min_zoom),
+        "maxzoom": str(max_zoom),
+        "bounds": f"{min_lon},{min_lat},{max_lon},{max_lat}",
+        "center": f"{(min_lon + max_lon) / 2},{(min_lat + max_lat) / 2},{min_zoom}",
+        "json": json.dumps({"vector_layers": [{"id": TILE_LAYER_NAME, "fields": {"MMSI": "Number"},
+                                               "minzoom": min_zoom, "maxzoom": max_zoom}]}),
+    }
+
+
+# Function to write the tiles into an MBTiles file (TMS row numbering, gzip compressed tile data)
+def write_mbtiles(tiles, output_path, metadata):
+    temp_path = f"{output_path}.tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    connection = sqlite3.connect(temp_path)
+    connection.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+    connection.execute("CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, "
+                       "tile_data BLOB)")
+    connection.execute("CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)")
+    connection.executemany("INSERT INTO metadata VALUES (?, ?)", metadata.items())
+
+    count = 0
+    for zoom, x, y, tile_data in tiles:
+        connection.execute("INSERT INTO tiles VALUES (?, ?, ?, ?)",
+                           (zoom, x, 2 ** zoom - 1 - y, gzip.compress(tile_data)))
+        count += 1
+    connection.commit()
+    connection.close()
+    os.replace(temp_path, output_path)
+    return count
+
+
+# Function to write the tiles as z/x/y.pbf files with a metadata.json next to them
+def write_tile_directory(tiles, output_dir, metadata):
+    count = 0
+    for zoom, x, y, tile_data in tiles:
+        tile_dir = os.path.join(output_dir, str(zoom), str(x))
+        os.makedirs(tile_dir, exist_ok=True)
+        with open(os.path.join(tile_dir, f"{y}.pbf"), "wb") as f:
+            f.write(tile_data)
+        count += 1
+    with open(os.path.join(output_dir, "metadata.json"), "w") as f:
+        json.dump(metadata, f, indent=2)
+    return count
+
+
+# Function to export the trajectories below input_dir as a simplified vector tile pyramid
+def export_vector_tiles(input_dir, output_path, min_zoom=4, max_zoom=12, tolerance_px=1.0,
+                        tiles_format="mbtiles"):
+    start_time = time.perf_counter()
+    lines, _ = collect_trajectory_layers(input_dir, include_points=False)
+    if lines is None:
+        print(f"No trajectories found in {input_dir}")
+        return None
+
+    geometries = lines.to_crs("EPSG:3857").geometry.to_numpy()
+    mmsis = lines['MMSI'].to_numpy()
+    name = os.path.splitext(os.path.basename(os.path.normpath(output_path)))[0]
+    metadata = build_tile_metadata(lines, min_zoom, max_zoom, name)
+
+    def all_tiles():
+        for zoom in range(min_zoom, max_zoom + 1):
+            for x, y, tile_data in build_zoom_tiles(geometries, mmsis, zoom, tolerance_px):
+                yield zoom, x, y, tile_data
+
+    if tiles_format == "mbtiles":
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        count = write_mbtiles(all_tiles(), output_path, metadata)
+    else:
+        os.makedirs(output_path, exist_ok=True)
+        count = write_tile_directory(all_tiles(), output_path, metadata)
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Wrote {count} tiles of {len(lines)} trajectories (zoom {min_zoom}-{max_zoom}) "
+          f"to {output_path} in {elapsed:.2f} s")
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export trajectory CSV files as a simplified vector tile pyramid.")
+    parser.add_argument("input_dir", type=str, help="Directory containing trajectory CSV files.")
+    parser.add_argument("output_path", type=str,
+                        help="MBTiles file, or directory of z/x/y.pbf tiles with --tiles_format dir.")
+    parser.add_argument("--min_zoom", type=int, default=4, help="Lowest zoom level to build.")
+    parser.add_argument("--max_zoom", type=int, default=12, help="Highest zoom level to build.")
+    parser.add_argument("--tolerance_px", type=float, default=1.0,
+                        help="Douglas-Peucker tolerance in screen pixels of each zoom level.")
+    parser.add_argument("--tiles_format", choices=["mbtiles", "dir"], default="mbtiles",
+                        help="Write one MBTiles file or a directory of .pbf tiles.")
+    args = parser.parse_args(argv)
+
+    export_vector_tiles(args.input_dir, args.output_path, args.min_zoom, args.max_zoom, args.tolerance_px,
+                        args.tiles_format)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import os
+import time
+import argparse
+import numpy as np
+from ais_loader import TIMESTAMP_COLUMN, load_ais_csv, save_ais_csv
+
+# Realistic-frequency dropout of AIS positions. A recorded trajectory is thinned to the schedule a Class A
+# transponder reports at (ITU-R M.1371 reporting intervals), given its speed, course changes and navigational status,
+# and the scheduled reports are then lost at random as with a real receiver. Everything is computed over whole
+# columns: the number of reports due since the start of each track is the running sum of dt / interval, and a point
+# is kept when at least one report fell due since the point before it. Files of whole days with many vessels are
+# handled by treating every MMSI as its own track.
+
+# Reporting intervals (seconds) of Class A transponders
+ANCHORED_INTERVAL = 180.0         # At anchor or moored, at most 3 knots
+SLOW_INTERVAL = 10.0              # 0-14 knots
+SLOW_TURNING_INTERVAL = 10.0 / 3  # 0-14 knots and changing course
+FAST_INTERVAL = 6.0               # 14-23 knots
+FAST_TURNING_INTERVAL = 2.0       # 14-23 knots and changing course
+VERY_FAST_INTERVAL = 2.0          # Over 23 knots
+
+ANCHORED_STATUSES = ["At anchor", "Moored"]
+ANCHORED_MAX_SOG = 3.0
+
+# Course change (degrees per minute) from which a vessel counts as changing course
+DEFAULT_TURN_RATE_THRESHOLD = 5.0
+DEFAULT_LOSS_PROBABILITY = 0.1
+
+DROPOUT_SUFFIX = "_transmission_dropout.csv"
+
+
+# Function to get the seconds since the epoch of the timestamps, NaN where the timestamp is missing
+def get_timestamp_seconds(timestamps):
+    timestamps = np.asarray(timestamps, dtype="datetime64[ns]")
+    seconds = timestamps.astype(np.int64) / 1e9
+    seconds[np.isnat(timestamps)] = np.nan
+    return seconds
+
+
+# Function to get the absolute course change (degrees per minute) over the interval ending at every point, 0 for the
+# first point of a track and where COG is not available (NaN or 360)
+def get_course_change_rates(cog, dt, new_track):
+    cog = np.asarray(cog, dtype=np.float64)
+    change = np.zeros(len(cog))
+    change[1:] = np.abs((cog[1:] - cog[:-1] + 180) % 360 - 180)
+    available = (cog >= 0) & (cog < 360)
+    change[~(available & np.roll(available, 1)) | new_track] = 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rates = np.where(dt > 0, change / dt * 60, 0.0)
+    return np.nan_to_num(rates)
+
+
+# Function to get the reporting interval (seconds) of every point from its speed over ground (knots), course change
+# rate (degrees per minute) and navigational status
+def get_reporting_intervals(sog, course_change_rates, anchored, turn_rate_threshold=DEFAULT_TURN_RATE_THRESHOLD):
+    sog = np.nan_to_num(np.asarray(sog, dtype=np.float64))  # Unknown speed counts as 0-14 knots
+    turning = course_change_rates >= turn_rate_threshold
+    intervals = np.select(
+        [anchored & (sog <= ANCHORED_MAX_SOG), sog > 23, sog > 14],
+        [ANCHORED_INTERVAL, VERY_FAST_INTERVAL, np.where(turning, FAST_TURNING_INTERVAL, FAST_INTERVAL)],
+        default=np.where(turning, SLOW_TURNING_INTERVAL, SLOW_INTERVAL))
+    return intervals
+
+
+# Function to get the mask of the points kept after thinning to the reporting schedule and random reception loss.
+# data needs the timestamp, SOG and COG columns; MMSI and Navigational status are used when present. Each track
+# starts its schedule at a random phase. rng is the random generator to draw from, np.random by default.
+def simulate_transmission_dropout(data, loss_probability=DEFAULT_LOSS_PROBABILITY,
+                                  turn_rate_threshold=DEFAULT_TURN_RATE_THRESHOLD, rng=np.random):
+    n = len(data)
+    if n == 0:
+        return np.zeros(0, dtype=bool)
+
+    # Order the points by track and time; single trajectories are usually in this order already
+    seconds = get_timestamp_seconds(data[TIMESTAMP_COLUMN])
+    mmsi = data['MMSI'].to_numpy() if 'MMSI' in data.columns else np.zeros(n)
+    order = np.lexsort((seconds, mmsi))
+    seconds = seconds[order]
+    mmsi = mmsi[order]
+
+    # A new track starts at every change of MMSI, and after a missing timestamp
+    new_track = np.ones(n, dtype=bool)
+    new_track[1:] = mmsi[1:] != mmsi[:-1]
+    missing_time = np.isnan(seconds)
+    new_track |= missing_time | np.roll(missing_time, 1)
+    new_track[0] = True
+    dt = np.zeros(n)
+    dt[1:] = seconds[1:] - seconds[:-1]
+    dt[new_track] = 0
+
+    if 'Navigational status' in data.columns:
+        anchored = data['Navigational status'].isin(ANCHORED_STATUSES).to_numpy()[order]
+    else:
+        anchored = np.zeros(n, dtype=bool)
+    rates = get_course_change_rates(data['COG'].to_numpy()[order], dt, new_track)
+    intervals = get_reporting_intervals(data['SOG'].to_numpy()[order], rates, anchored, turn_rate_threshold)
+
+    # Reports due since the start of each track, shifted so that every track starts at its own random phase
+    reports_due = np.cumsum(dt / intervals)
+    track_starts = np.flatnonzero(new_track)
+    track_ids = np.cumsum(new_track) - 1
+    reports_due += (rng.random(len(track_starts)) - reports_due[track_starts])[track_ids]
+
+    # Keep the first point of each track and every point a report fell due for, minus the lost receptions
+    slots = np.floor(reports_due)
+    scheduled = new_track.copy()
+    scheduled[1:] |= slots[1:] > slots[:-1]
+    received = rng.random(n) >= loss_probability
+
+    kept = np.empty(n, dtype=bool)
+    kept[order] = scheduled & received
+    return kept
+
+
+# Function to thin a trajectory (or a whole day of AIS data) to the realistic reporting frequency
+def apply_transmission_dropout(data, loss_probability=DEFAULT_LOSS_PROBABILITY,
+                               turn_rate_threshold=DEFAULT_TURN_RATE_THRESHOLD, rng=np.random):
+    return data[simulate_transmission_dropout(data, loss_probability, turn_rate_threshold, rng)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Thin AIS CSV files to the Class A reporting frequency with random "
+                                                 "reception loss.")
+    parser.add_argument("--input_dir", type=str, required=True,
+                        help="Directory containing input CSV files (trajectories or whole days of AIS data).")
+    parser.add_argument("--output_dir", type=str, required=True,
+                        help=f"Directory to save the thinned CSV files, with the {DROPOUT_SUFFIX} suffix.")
+    parser.add_argument("--loss_probability", type=float, default=DEFAULT_LOSS_PROBABILITY,
+                        help="Probability that a scheduled report is not received.")
+    parser.add_argument("--turn_rate_threshold", type=float, default=DEFAULT_TURN_RATE_THRESHOLD,
+                        help="Course change (degrees per minute) from which a vessel counts as changing course.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the random phases and reception losses.")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    os.makedirs(args.output_dir, exist_ok=True)
+    for filename in sorted(os.listdir(args.input_dir)):
+        if filename.endswith(".csv"):
+            try:
+                # The coordinates stay float64 since they are written back out
+                data = load_ais_csv(os.path.join(args.input_dir, filename), coordinate_dtype="float64")
+
+                start_time = time.perf_counter()
+                sparse_data = apply_transmission_dropout(data, args.loss_probability, args.turn_rate_threshold, rng)
+                elapsed = time.perf_counter() - start_time
+
+                save_ais_csv(sparse_data, os.path.join(args.output_dir, filename.replace(".csv", DROPOUT_SUFFIX)))
+                rate = len(data) / elapsed if elapsed > 0 else float('inf')
+                print(f"{filename}: kept {len(sparse_data)} of {len(data)} points ({rate:,.0f} points/s)")
+            except Exception as e:
+                print(f"Error processing file {filename}: {e}")
+
+
+if __name__ == "__main__":
+    main()